@@ -9,8 +9,11 @@ try:
 except ImportError:
     METAL_PYTHON_AVAILABLE = False
 
+import ipaddress
+
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module
+from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module, run_concurrently, \
+    allocation_networks
 
 ANSIBLE_METADATA = {
     'metadata_version': '0.1',
@@ -93,6 +96,41 @@ options:
         choices:
           - absent
           - present
+    normalize_rules:
+        description:
+            - >-
+              Compacts the rules before they are deployed. Overlapping and adjacent networks are collapsed,
+              the ports of rules with the same protocol and networks are merged and duplicate rules are dropped.
+              The comment of the first merged rule is kept.
+            - The number of rules before and after the normalization is returned in C(rules_reduction).
+        default: false
+    rules_drift:
+        description:
+            - >-
+              What to do when the rules of an existing firewall differ from the given rules.
+              The metal-api cannot update the rules of an allocated firewall, they only take effect
+              when the firewall is allocated again.
+            - Rules are compared by protocol, ports and networks, comments are ignored.
+            - The difference is returned in C(rules_diff).
+        default: warn
+        choices:
+          - ignore
+          - warn
+          - fail
+    firewalls:
+        description:
+            - >-
+              A list of firewalls to manage within the project in a single module run.
+              The firewalls of the project are fetched once and identified by their unique name,
+              missing firewalls are then allocated (or existing ones released) concurrently.
+            - Every firewall accepts name (required), id, hostname, description, ips, tags and rules.
+              All other allocation parameters are taken from the module parameters.
+            - The result of every firewall is returned in C(firewalls).
+        required: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests when managing a list of firewalls.
+        default: 10
 
 author:
     - metal-stack
@@ -127,6 +165,23 @@ EXAMPLES = '''
   metal_firewall:
     id: 306bc4ad-33cd-4744-8c6a-6b601f7179ea
     state: absent
+
+- name: allocate a firewall for every cluster
+  metal_firewall:
+    firewalls:
+    - name: cluster-a-firewall
+    - name: cluster-b-firewall
+      rules:
+        egress:
+          - ports: [443]
+            to:
+              - 0.0.0.0/0
+    networks:
+    - internet
+    size: c1-xlarge-x86
+    image: firewall-ubuntu-3.0
+    partition: fra-equ01
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
 '''
 
 RETURN = '''
@@ -136,8 +191,200 @@ id:
   returned: always
   type: str
   sample: 306bc4ad-33cd-4744-8c6a-6b601f7179ea
+rules_reduction:
+  description:
+    - the number of ingress and egress rules before and after the normalization
+  returned: when normalize_rules is true and rules are given
+  type: dict
+  sample: {"ingress": {"before": 120, "after": 14}, "egress": {"before": 30, "after": 3}}
+rules_diff:
+  description:
+    - the ingress and egress rules which would be added or removed on the existing firewall
+  returned: when the firewall exists and its rules differ from the given rules
+  type: dict
+  sample: {"egress": {"added": [{"protocol": "tcp", "ports": [443], "to": ["0.0.0.0/0"]}], "removed": []}}
+firewalls:
+  description:
+    - the results of every firewall when managing a list of firewalls
+  returned: when firewalls is given
+  type: list
+  sample: [{"name": "cluster-a-firewall", "id": "306bc4ad-33cd-4744-8c6a-6b601f7179ea", "state": "present",
+            "changed": true}]
 '''
 
+RULES_SPEC = dict(
+    ingress=dict(type='list', required=False, options=dict(
+        comment=dict(type='str', required=False),
+        source=dict(type='list', required=True),
+        ports=dict(type='list', required=True),
+        protocol=dict(type='str', required=False),
+        to=dict(type='list', required=False),
+    )),
+    egress=dict(type='list', required=False, options=dict(
+        comment=dict(type='str', required=False),
+        ports=dict(type='list', required=True),
+        protocol=dict(type='str', required=False),
+        to=dict(type='list', required=True),
+    )),
+)
+
+
+def firewall_rules(rules):
+    result = models.V1FirewallRules(
+        ingress=[],
+        egress=[],
+    )
+
+    for rule in rules.get('ingress') or []:
+        elem = models.V1FirewallIngressRule(
+            _from=rule.get('source'),
+            ports=rule.get('ports'),
+            to=rule.get('to') or [],
+        )
+
+        if rule.get('comment'):
+            elem.comment = rule.get('comment')
+        if rule.get('protocol'):
+            elem.protocol = rule.get('protocol')
+
+        result.ingress.append(elem)
+
+    for rule in rules.get('egress') or []:
+        elem = models.V1FirewallEgressRule(
+            ports=rule.get('ports'),
+            protocol=rule.get('protocol'),
+            to=rule.get('to'),
+        )
+
+        if rule.get('comment'):
+            elem.comment = rule.get('comment')
+        if rule.get('protocol'):
+            elem.protocol = rule.get('protocol')
+
+        result.egress.append(elem)
+
+    return result
+
+
+def _collapse(networks):
+    parsed = {4: [], 6: []}
+    unparsed = set()
+    for n in networks or []:
+        try:
+            network = ipaddress.ip_network(n, strict=False)
+        except ValueError:
+            unparsed.add(n)
+            continue
+        parsed[network.version].append(network)
+    return [str(n) for v in (4, 6) for n in ipaddress.collapse_addresses(parsed[v])] + sorted(unparsed)
+
+
+def _merge(rules, merge_key, merge):
+    merged = dict()
+    for r in rules:
+        key = merge_key(r)
+        if key in merged:
+            merge(merged[key], r)
+        else:
+            merged[key] = r
+    return list(merged.values())
+
+
+def _normalize(rules, networks):
+    plain = [dict(
+        comment=r.comment,
+        protocol=(r.protocol or "tcp").lower(),
+        ports=sorted(set(r.ports or [])),
+        networks=dict((n, _collapse(getattr(r, n))) for n in networks),
+    ) for r in rules or []]
+
+    # rules only differing in the last network list, e.g. the source of ingress rules, are merged into one
+    varying = networks[-1]
+
+    def networks_key(r):
+        return (r["protocol"], tuple(r["ports"])) + tuple(tuple(r["networks"][n]) for n in networks if n != varying)
+
+    def merge_networks(into, r):
+        into["networks"][varying] = _collapse(into["networks"][varying] + r["networks"][varying])
+        into["comment"] = into["comment"] or r["comment"]
+
+    plain = _merge(plain, networks_key, merge_networks)
+
+    # afterwards rules with the same networks are merged into one port list
+    def ports_key(r):
+        return (r["protocol"],) + tuple(tuple(r["networks"][n]) for n in networks)
+
+    def merge_ports(into, r):
+        into["ports"] = sorted(set(into["ports"] + r["ports"]))
+        into["comment"] = into["comment"] or r["comment"]
+
+    return _merge(plain, ports_key, merge_ports)
+
+
+def normalize_rules(rules):
+    """
+    compacts V1FirewallRules by collapsing networks, merging ports and dropping duplicates.
+    returns the normalized rules and the number of rules before and after per direction.
+    """
+    ingress = list()
+    for r in _normalize(rules.ingress, ("to", "_from")):
+        elem = models.V1FirewallIngressRule(
+            _from=r["networks"]["_from"],
+            ports=r["ports"],
+            protocol=r["protocol"],
+            to=r["networks"]["to"],
+        )
+        if r["comment"]:
+            elem.comment = r["comment"]
+        ingress.append(elem)
+
+    egress = list()
+    for r in _normalize(rules.egress, ("to",)):
+        elem = models.V1FirewallEgressRule(
+            ports=r["ports"],
+            protocol=r["protocol"],
+            to=r["networks"]["to"],
+        )
+        if r["comment"]:
+            elem.comment = r["comment"]
+        egress.append(elem)
+
+    reduction = dict(
+        ingress=dict(before=len(rules.ingress), after=len(ingress)),
+        egress=dict(before=len(rules.egress), after=len(egress)),
+    )
+    return models.V1FirewallRules(ingress=ingress, egress=egress), reduction
+
+
+def _rule_key(rule, networks):
+    return (
+        (rule.protocol or "tcp").lower(),
+        tuple(sorted(set(rule.ports or []))),
+    ) + tuple(tuple(sorted(set(getattr(rule, n) or []))) for n in networks)
+
+
+def rules_diff(desired, deployed):
+    """
+    compares two V1FirewallRules by protocol, ports and networks of their rules.
+    returns the added and removed rules per direction, an empty dict if the rules are equal.
+    """
+    diff = dict()
+    for direction, networks in (("ingress", ("_from", "to")), ("egress", ("to",))):
+        want = dict((_rule_key(r, networks), r) for r in getattr(desired, direction, None) or [])
+        have = dict((_rule_key(r, networks), r) for r in getattr(deployed, direction, None) or [])
+
+        def plain(key):
+            r = dict(protocol=key[0], ports=list(key[1]))
+            for n, values in zip(networks, key[2:]):
+                r["source" if n == "_from" else n] = list(values)
+            return r
+
+        added = [plain(k) for k in sorted(set(want) - set(have))]
+        removed = [plain(k) for k in sorted(set(have) - set(want))]
+        if added or removed:
+            diff[direction] = dict(added=added, removed=removed)
+    return diff
+
 
 class Instance(object):
     def __init__(self, module):
@@ -161,7 +408,11 @@ class Instance(object):
         self._ssh_pub_keys = module.params.get('ssh_pub_keys')
         self._userdata = module.params.get('userdata')
         self._rules = module.params.get('rules')
+        self._rules_drift = module.params.get('rules_drift')
+        self._normalize_rules = module.params.get('normalize_rules')
         self._state = module.params.get('state')
+        self.rules_diff = None
+        self.rules_reduction = None
         self._driver = init_driver_for_module(self._module)
         self._api_client = FirewallApi(api_client=self._driver.client)
         self._machine_api_client = MachineApi(api_client=self._driver.client)
@@ -177,6 +428,7 @@ class Instance(object):
 
         if self._state == "present":
             if self._firewall:
+                self._check_rules()
                 return
 
             self._allocate()
@@ -215,22 +467,10 @@ class Instance(object):
             self.id = self._firewall.id
 
     def _allocate(self):
-        networks = list()
-        for n in self._networks:
-            auto_acquire = True
-            network_id = n
-            if ":" in n:
-                network_id = n.split(":")[0]
-                mode = n.split(":")[-1]
-                if mode == "noauto":
-                    auto_acquire = False
-                elif mode == "auto":
-                    auto_acquire = True
-                else:
-                    self._module.fail_json(
-                        msg="network acquisition mode not supported: %s" % mode)
-
-            networks.append(models.V1MachineAllocationNetwork(autoacquire=auto_acquire, networkid=network_id))
+        try:
+            networks = allocation_networks(self._networks)
+        except ValueError as e:
+            self._module.fail_json(msg=str(e))
 
         self._tags.append(ANSIBLE_CI_MANAGED_TAG)
 
@@ -251,40 +491,7 @@ class Instance(object):
         )
 
         if self._rules:
-            rules = models.V1FirewallRules(
-                ingress=[],
-                egress=[],
-            )
-
-            for rule in self._rules.get('ingress', []):
-                elem = models.V1FirewallIngressRule(
-                    _from=rule.get('source'),
-                    ports=rule.get('ports'),
-                    to=rule.get('to', []),
-                )
-
-                if rule.get('comment'):
-                    elem.comment = rule.get('comment')
-                if rule.get('protocol'):
-                    elem.protocol = rule.get('protocol')
-
-                rules.ingress.append(elem)
-
-            for rule in self._rules.get('egress', []):
-                elem = models.V1FirewallEgressRule(
-                    ports=rule.get('ports'),
-                    protocol=rule.get('protocol'),
-                    to=rule.get('to'),
-                )
-
-                if rule.get('comment'):
-                    elem.comment = rule.get('comment')
-                if rule.get('protocol'):
-                    elem.protocol = rule.get('protocol')
-
-                rules.egress.append(elem)
-
-            r.firewall_rules = rules
+            r.firewall_rules = self._firewall_rules()
 
         try:
             self._firewall = self._api_client.allocate_firewall(r)
@@ -293,6 +500,26 @@ class Instance(object):
 
         self.id = self._firewall.id
 
+    def _firewall_rules(self):
+        rules = firewall_rules(self._rules)
+        if self._normalize_rules:
+            rules, self.rules_reduction = normalize_rules(rules)
+        return rules
+
+    def _check_rules(self):
+        if self._rules is None or self._rules_drift == "ignore":
+            return
+
+        diff = rules_diff(self._firewall_rules(), self._firewall.allocation.firewall_rules)
+        if not diff:
+            return
+
+        self.rules_diff = diff
+        msg = "rules of firewall %s differ from the deployed rules, they only apply on allocation" % self.id
+        if self._rules_drift == "fail":
+            self._module.fail_json(msg=msg, id=self.id, rules_diff=diff)
+        self._module.warn(msg)
+
     def _free(self):
         if ANSIBLE_CI_MANAGED_TAG not in self._firewall.tags:
             self._module.fail_json(msg="entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_TAG,
@@ -305,6 +532,151 @@ class Instance(object):
             self._module.fail_json(msg="request to metal-api failed", error=str(e))
 
 
+class BulkInstance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._firewalls = module.params.get('firewalls')
+        self._project = module.params.get('project')
+        self._partition = module.params.get('partition')
+        self._image = module.params.get('image')
+        self._size = module.params.get('size')
+        self._description = module.params.get('description')
+        self._networks = module.params.get('networks') if module.params.get('networks') else []
+        self._tags = module.params.get('tags') if module.params.get('tags') else []
+        self._ssh_pub_keys = module.params.get('ssh_pub_keys')
+        self._userdata = module.params.get('userdata')
+        self._rules = module.params.get('rules')
+        self._rules_drift = module.params.get('rules_drift')
+        self._normalize_rules = module.params.get('normalize_rules')
+        self._state = module.params.get('state')
+        self._parallelism = module.params.get('parallelism')
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = FirewallApi(api_client=self._driver.client)
+        self._machine_api_client = MachineApi(api_client=self._driver.client)
+
+        names = [f['name'] for f in self._firewalls]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            module.fail_json(msg="firewall names must be unique within the list of firewalls", names=duplicates)
+
+        try:
+            self._allocation_networks = allocation_networks(self._networks)
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+
+    def run(self):
+        if self._module.check_mode:
+            return
+
+        r = models.V1FirewallFindRequest(
+            allocation_project=self._project,
+        )
+        try:
+            existing = self._api_client.find_firewalls(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        by_name = dict()
+        for firewall in existing:
+            by_name.setdefault(firewall.allocation.name, list()).append(firewall)
+
+        outcomes = run_concurrently(lambda item: self._apply(item, by_name.get(item['name'], [])),
+                                    self._firewalls, self._parallelism)
+
+        failed = False
+        for item, (result, error) in zip(self._firewalls, outcomes):
+            if error is not None:
+                failed = True
+                result = dict(name=item['name'], changed=False, failed=True, msg=str(error))
+            self.changed = self.changed or result['changed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all firewalls could be managed", changed=self.changed,
+                                   firewalls=self.results)
+
+    def _apply(self, item, found):
+        name = item['name']
+        result = dict(name=name, state=self._state, id=None, changed=False)
+
+        if len(found) > 1:
+            raise RuntimeError("multiple firewalls of name '%s' exist in project '%s'. module idempotence depends on "
+                               "unique names within a project, please ensure unique names." % (name, self._project))
+
+        firewall = found[0] if found else None
+
+        if self._state == "present":
+            if firewall:
+                result.update(id=firewall.id)
+                self._check_rules(item, firewall, result)
+                return result
+
+            firewall = self._api_client.allocate_firewall(self._allocate_request(item, result))
+            result.update(id=firewall.id, changed=True)
+            return result
+
+        if firewall:
+            if ANSIBLE_CI_MANAGED_TAG not in firewall.tags:
+                raise RuntimeError("entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_TAG)
+            self._machine_api_client.free_machine(firewall.id)
+            result.update(id=firewall.id, changed=True)
+
+        return result
+
+    def _check_rules(self, item, firewall, result):
+        rules = item['rules'] if item.get('rules') else self._rules
+        if rules is None or self._rules_drift == "ignore":
+            return
+
+        diff = rules_diff(self._firewall_rules(rules, result), firewall.allocation.firewall_rules)
+        if not diff:
+            return
+
+        result.update(rules_diff=diff)
+        msg = "rules of firewall %s differ from the deployed rules, they only apply on allocation" % firewall.id
+        if self._rules_drift == "fail":
+            raise RuntimeError(msg)
+        self._module.warn(msg)
+
+    def _firewall_rules(self, rules, result):
+        rules = firewall_rules(rules)
+        if self._normalize_rules:
+            rules, reduction = normalize_rules(rules)
+            result.update(rules_reduction=reduction)
+        return rules
+
+    def _allocate_request(self, item, result):
+        tags = item['tags'] if item.get('tags') else list(self._tags)
+        rules = item['rules'] if item.get('rules') else self._rules
+
+        r = models.V1FirewallCreateRequest(
+            uuid=item.get('id'),
+            name=item['name'],
+            description=item['description'] if item.get('description') else self._description,
+            hostname=item['hostname'] if item.get('hostname') else item['name'],
+            partitionid=self._partition,
+            projectid=self._project,
+            imageid=self._image,
+            ips=item['ips'] if item.get('ips') else [],
+            sizeid=self._size,
+            networks=self._allocation_networks,
+            tags=tags + [ANSIBLE_CI_MANAGED_TAG],
+            ssh_pub_keys=self._ssh_pub_keys,
+            user_data=self._userdata,
+        )
+
+        if rules:
+            r.firewall_rules = self._firewall_rules(rules, result)
+
+        return r
+
+
 def main():
     argument_spec = AUTH_SPEC.copy()
     argument_spec.update(dict(
@@ -321,28 +693,32 @@ def main():
         tags=dict(type='list', default=list(), required=False),
         ssh_pub_keys=dict(type='list', default=list(), required=False),
         userdata=dict(type='str', required=False),
-        rules=dict(type='dict', required=False, options=dict(
-            ingress=dict(type='list', required=False, options=dict(
-                comment=dict(type='str', required=False),
-                source=dict(type='list', required=True),
-                ports=dict(type='list', required=True),
-                protocol=dict(type='str', required=False),
-                to=dict(type='list', required=False),
-            )),
-            egress=dict(type='list', required=False, options=dict(
-                comment=dict(type='str', required=False),
-                ports=dict(type='list', required=True),
-                protocol=dict(type='str', required=False),
-                to=dict(type='list', required=True),
-            )),
-        )),
+        rules=dict(type='dict', required=False, options=RULES_SPEC),
+        normalize_rules=dict(type='bool', default=False),
+        rules_drift=dict(type='str', choices=['ignore', 'warn', 'fail'], default='warn'),
         state=dict(type='str', choices=['present', 'absent'], default='present'),
+        firewalls=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            id=dict(type='str', required=False),
+            hostname=dict(type='str', required=False),
+            description=dict(type='str', required=False),
+            ips=dict(type='list', required=False),
+            tags=dict(type='list', required=False),
+            rules=dict(type='dict', required=False, options=RULES_SPEC),
+        )),
+        parallelism=dict(type='int', default=10),
     ))
     module = AnsibleModule(
         argument_spec=argument_spec,
         supports_check_mode=True,
+        mutually_exclusive=[('firewalls', 'id'), ('firewalls', 'name')],
     )
 
+    if module.params.get('firewalls'):
+        instance = BulkInstance(module)
+        instance.run()
+        module.exit_json(changed=instance.changed, firewalls=instance.results)
+
     instance = Instance(module)
 
     instance.run()
@@ -351,6 +727,10 @@ def main():
         changed=instance.changed,
         id=instance.id,
     )
+    if instance.rules_diff:
+        result.update(rules_diff=instance.rules_diff)
+    if instance.rules_reduction:
+        result.update(rules_reduction=instance.rules_reduction)
 
     module.exit_json(**result)
 
@@ -10,7 +10,7 @@ except ImportError:
     METAL_PYTHON_AVAILABLE = False
 
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module
+from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module, run_concurrently
 
 ANSIBLE_METADATA = {
     'metadata_version': '0.1',
@@ -53,6 +53,7 @@ options:
     project:
         description:
             - The project of the ip.
+            - Required when managing a list of ips.
         required: false
     type:
         description:
@@ -71,6 +72,20 @@ options:
         choices:
           - absent
           - present
+    ips:
+        description:
+            - >-
+              A list of ips to manage within the project in a single module run.
+              The ips of the project are fetched once and identified by their unique name,
+              allocations, updates and frees are then sent concurrently.
+            - Every ip accepts name (required), description, network, type, tags and state.
+              network and type default to the module parameters of the same name.
+            - The result of every ip is returned in C(ips).
+        required: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests when managing a list of ips.
+        default: 10
 
 author:
     - metal-stack
@@ -98,6 +113,20 @@ EXAMPLES = '''
   metal_ip:
     ip: 212.34.83.13
     state: absent
+
+- name: manage the ips of a project
+  metal_ip:
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    network: internet-fra-equ01
+    type: static
+    ips:
+    - name: ingress
+      description: "ingress ip"
+    - name: egress
+      tags:
+      - egress
+    - name: obsolete
+      state: absent
 '''
 
 RETURN = '''
@@ -107,9 +136,52 @@ ip:
   returned: always
   type: str
   sample: 212.34.83.13
+ips:
+  description:
+    - the results of every ip when managing a list of ips
+  returned: when ips is given
+  type: list
+  sample: [{"name": "ingress", "ip": "212.34.83.13", "state": "present", "changed": true}]
 '''
 
 
+def update_request(ip, name, description, tags, ip_type):
+    """
+    returns the update request for an existing ip and whether it changes anything
+    """
+    changed = False
+    r = models.V1IPUpdateRequest(
+        ipaddress=ip.ipaddress,
+        type=ip.type,
+    )
+
+    if ip.description != description:
+        changed = True
+        r.description = description
+
+    if ip.name != name:
+        changed = True
+        r.name = name
+
+    tags = list(tags)
+    for tag in ip.tags:
+        # we need to maintain tags from the metal-ccm that are required for inserting an ip address
+        # into the metalLB ip pool
+        if tag.startswith("cluster.metal-stack.io/id/namespace/service"):
+            tags.append(tag)
+
+    tags.append(ANSIBLE_CI_MANAGED_TAG)
+    if sorted(ip.tags) != sorted(tags):
+        changed = True
+        r.tags = tags
+
+    if ip.type != ip_type:
+        changed = True
+        r.type = ip_type
+
+    return r, changed
+
+
 class Instance(object):
     def __init__(self, module):
         if not METAL_PYTHON_AVAILABLE:
@@ -183,35 +255,10 @@ class Instance(object):
             self.ip_address = self._ip.ipaddress
 
     def _update(self):
-        r = models.V1IPUpdateRequest(
-            ipaddress=self.ip_address,
-            type=self._ip.type,
-        )
-
-        if self._ip.description != self._description:
-            self.changed = True
-            r.description = self._description
+        r, changed = update_request(self._ip, self._name, self._description, self._tags, self._type)
 
-        if self._ip.name != self._name:
+        if changed:
             self.changed = True
-            r.name = self._name
-
-        for tag in self._ip.tags:
-            # we need to maintain tags from the metal-ccm that are required for inserting an ip address
-            # into the metalLB ip pool
-            if tag.startswith("cluster.metal-stack.io/id/namespace/service"):
-                self._tags.append(tag)
-
-        self._tags.append(ANSIBLE_CI_MANAGED_TAG)
-        if sorted(self._ip.tags) != sorted(self._tags):
-            self.changed = True
-            r.tags = self._tags
-
-        if self._ip.type != self._type:
-            self.changed = True
-            r.type = self._type
-
-        if self.changed:
             try:
                 self._ip = self._api_client.update_ip(r)
             except rest.ApiException as e:
@@ -248,6 +295,103 @@ class Instance(object):
             self._module.fail_json(msg="request to metal-api failed", error=str(e))
 
 
+class BulkInstance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._project = module.params.get('project')
+        self._network = module.params.get('network')
+        self._type = module.params.get('type')
+        self._ips = module.params.get('ips')
+        self._parallelism = module.params.get('parallelism')
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = IpApi(api_client=self._driver.client)
+
+        if self._project is None:
+            module.fail_json(msg="project is required when managing a list of ips")
+
+        names = [ip['name'] for ip in self._ips]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            module.fail_json(msg="ip names must be unique within the list of ips", names=duplicates)
+
+    def run(self):
+        if self._module.check_mode:
+            return
+
+        r = models.V1IPFindRequest(
+            projectid=self._project,
+        )
+        try:
+            existing = self._api_client.find_i_ps(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        by_name = dict()
+        for ip in existing:
+            by_name.setdefault(ip.name, list()).append(ip)
+
+        outcomes = run_concurrently(lambda item: self._apply(item, by_name.get(item['name'], [])),
+                                    self._ips, self._parallelism)
+
+        failed = False
+        for item, (result, error) in zip(self._ips, outcomes):
+            if error is not None:
+                failed = True
+                result = dict(name=item['name'], changed=False, failed=True, msg=str(error))
+            self.changed = self.changed or result['changed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all ips could be managed", changed=self.changed, ips=self.results)
+
+    def _apply(self, item, found):
+        name = item['name']
+        state = item['state']
+        result = dict(name=name, state=state, ip=None, changed=False)
+
+        if len(found) > 1:
+            raise RuntimeError("multiple ips of name '%s' exist in project '%s'. module idempotence depends on "
+                               "unique names within a project, please ensure unique names." % (name, self._project))
+
+        ip = found[0] if found else None
+
+        if state == "present":
+            ip_type = item['type'] if item.get('type') else self._type
+            tags = item['tags'] if item.get('tags') else []
+
+            if ip:
+                r, changed = update_request(ip, name, item.get('description'), tags, ip_type)
+                if changed:
+                    ip = self._api_client.update_ip(r)
+                result.update(ip=ip.ipaddress, changed=changed)
+                return result
+
+            ip = self._api_client.allocate_ip(models.V1IPAllocateRequest(
+                description=item.get('description'),
+                name=name,
+                networkid=item['network'] if item.get('network') else self._network,
+                projectid=self._project,
+                tags=tags + [ANSIBLE_CI_MANAGED_TAG],
+                type=ip_type,
+            ))
+            result.update(ip=ip.ipaddress, changed=True)
+            return result
+
+        if ip:
+            if ANSIBLE_CI_MANAGED_TAG not in ip.tags:
+                raise RuntimeError("entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_TAG)
+            self._api_client.free_ip(ip.ipaddress)
+            result.update(ip=ip.ipaddress, changed=True)
+
+        return result
+
+
 def main():
     argument_spec = AUTH_SPEC.copy()
     argument_spec.update(dict(
@@ -259,12 +403,27 @@ def main():
         tags=dict(type='list', required=False),
         type=dict(type='str', choices=['static', 'ephemeral'], default='ephemeral'),
         state=dict(type='str', choices=['present', 'absent'], default='present'),
+        ips=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            description=dict(type='str', required=False),
+            network=dict(type='str', required=False),
+            tags=dict(type='list', required=False),
+            type=dict(type='str', choices=['static', 'ephemeral'], required=False),
+            state=dict(type='str', choices=['present', 'absent'], default='present'),
+        )),
+        parallelism=dict(type='int', default=10),
     ))
     module = AnsibleModule(
         argument_spec=argument_spec,
         supports_check_mode=True,
+        mutually_exclusive=[('ips', 'ip'), ('ips', 'name')],
     )
 
+    if module.params.get('ips'):
+        instance = BulkInstance(module)
+        instance.run()
+        module.exit_json(changed=instance.changed, ips=instance.results)
+
     instance = Instance(module)
 
     instance.run()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+try:
+    from metal_python.api import IpApi, MachineApi
+    from metal_python import models
+
+    METAL_PYTHON_AVAILABLE = True
+except ImportError:
+    METAL_PYTHON_AVAILABLE = False
+
+import fnmatch
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module, run_concurrently, \
+    attached_ips
+
+ANSIBLE_METADATA = {
+    'metadata_version': '0.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: metal_ip_gc
+
+short_description: A module to free orphaned metal ip entities
+
+version_added: "2.8"
+
+description:
+    - Frees ips managed by these modules, which are not attached to any machine or firewall of their project.
+    - >-
+      The ips and the machines of every project are fetched once, the orphaned ips are then freed
+      concurrently.
+    - Ips used by services of a cluster (tagged by the metal-ccm) are never freed.
+    - Requires metal_python to be installed.
+
+options:
+    projects:
+        description:
+            - The projects to collect orphaned ips in.
+        required: true
+    type:
+        description:
+            - The type of ips to collect.
+        default: ephemeral
+        choices:
+          - ephemeral
+          - static
+          - all
+    name_pattern:
+        description:
+            - Only collects ips with a name matching this shell-style pattern, e.g. C(worker-*).
+        required: false
+    tag_pattern:
+        description:
+            - Only collects ips with at least one tag matching this shell-style pattern, e.g. C(cluster=test-*).
+        required: false
+    dry_run:
+        description:
+            - Only reports the orphaned ips without freeing them. Check mode behaves the same.
+        default: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests.
+        default: 10
+
+author:
+    - metal-stack
+'''
+
+EXAMPLES = '''
+- name: report orphaned ips
+  metal_ip_gc:
+    projects:
+    - 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    dry_run: true
+
+- name: free orphaned ips of test clusters
+  metal_ip_gc:
+    projects:
+    - 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    - 6df6a987-922d-4c36-8cd9-5edbd1584f7a
+    tag_pattern: "cluster=test-*"
+'''
+
+RETURN = '''
+ips:
+  description:
+    - the orphaned ips, which were freed or, in dry run, would be freed
+  returned: always
+  type: list
+  sample: [{"ipaddress": "212.34.83.5", "name": "worker-1", "project": "9ec6882a-cd94-42a7-b667-ffaed43557c7",
+            "freed": true}]
+'''
+
+# tag prefix of ips used by load balancer services of a cluster, see metal_ip
+SERVICE_TAG_PREFIX = "cluster.metal-stack.io/id/namespace/service"
+
+
+class Instance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._projects = module.params.get('projects')
+        self._type = module.params.get('type')
+        self._name_pattern = module.params.get('name_pattern')
+        self._tag_pattern = module.params.get('tag_pattern')
+        self._dry_run = module.params.get('dry_run') or module.check_mode
+        self._parallelism = module.params.get('parallelism')
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = IpApi(api_client=self._driver.client)
+        self._machine_api_client = MachineApi(api_client=self._driver.client)
+
+    def run(self):
+        outcomes = run_concurrently(self._collect, self._projects, self._parallelism)
+
+        orphans = list()
+        for project, (ips, error) in zip(self._projects, outcomes):
+            if error is not None:
+                self._module.fail_json(msg="request to metal-api failed", project=project, error=str(error))
+                return
+            orphans.extend(ips)
+
+        if self._dry_run:
+            self.results = [self._result(ip, freed=False) for ip in orphans]
+            return
+
+        failed = False
+        outcomes = run_concurrently(lambda ip: self._api_client.free_ip(ip.ipaddress), orphans, self._parallelism)
+        for ip, (_, error) in zip(orphans, outcomes):
+            result = self._result(ip, freed=error is None)
+            if error is not None:
+                failed = True
+                result.update(failed=True, msg=str(error))
+            self.changed = self.changed or result['freed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all orphaned ips could be freed", changed=self.changed, ips=self.results)
+
+    def _collect(self, project):
+        r = models.V1IPFindRequest(projectid=project)
+        if self._type != "all":
+            r.type = self._type
+
+        ips = self._api_client.find_i_ps(r)
+        machines = self._machine_api_client.find_machines(models.V1MachineFindRequest(allocation_project=project))
+        attached = attached_ips(machines)
+
+        return [ip for ip in ips if ip.ipaddress not in attached and self._matches(ip)]
+
+    def _matches(self, ip):
+        tags = ip.tags or []
+        if ANSIBLE_CI_MANAGED_TAG not in tags:
+            return False
+        if any(tag.startswith(SERVICE_TAG_PREFIX) for tag in tags):
+            return False
+        if self._name_pattern and not fnmatch.fnmatchcase(ip.name or "", self._name_pattern):
+            return False
+        if self._tag_pattern and not any(fnmatch.fnmatchcase(tag, self._tag_pattern) for tag in tags):
+            return False
+        return True
+
+    @staticmethod
+    def _result(ip, freed):
+        return dict(ipaddress=ip.ipaddress, name=ip.name, project=ip.projectid, freed=freed)
+
+
+def main():
+    argument_spec = AUTH_SPEC.copy()
+    argument_spec.update(dict(
+        projects=dict(type='list', elements='str', required=True),
+        type=dict(type='str', choices=['ephemeral', 'static', 'all'], default='ephemeral'),
+        name_pattern=dict(type='str', required=False),
+        tag_pattern=dict(type='str', required=False),
+        dry_run=dict(type='bool', default=False),
+        parallelism=dict(type='int', default=10),
+    ))
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    instance = Instance(module)
+
+    instance.run()
+
+    module.exit_json(changed=instance.changed, ips=instance.results)
+
+
+if __name__ == '__main__':
+    main()
@@ -9,8 +9,11 @@ try:
 except ImportError:
     METAL_PYTHON_AVAILABLE = False
 
+import threading
+
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module
+from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module, run_concurrently, \
+    allocation_networks, wait_until, provisioning_events, provisioning_state
 
 ANSIBLE_METADATA = {
     'metadata_version': '0.1',
@@ -45,6 +48,7 @@ options:
     description:
         description:
             - The description of the machine.
+            - Updated in place on an existing machine.
         required: false
     hostname:
         description:
@@ -78,6 +82,9 @@ options:
     tags:
         description:
             - The tags of the machine.
+            - >-
+              Updated in place on an existing machine when given, tags added by the metal-api are kept.
+              Without tags, the tags of an existing machine are left untouched.
         required: false
     userdata:
         description:
@@ -97,6 +104,50 @@ options:
         choices:
           - absent
           - present
+    wait:
+        description:
+            - >-
+              Waits until the allocation of the machine succeeded. The machine is polled with exponential
+              backoff and fails early when the provisioning events show a crash loop or a failed reclaim.
+            - The observed provisioning events are returned in C(events).
+            - Not supported with C(machines) or C(count), use the metal_machine_wait module instead.
+        default: false
+    wait_timeout:
+        description:
+            - The number of seconds to wait for the machine to become ready.
+        default: 600
+    machines:
+        description:
+            - >-
+              A list of machines to manage within the project in a single module run.
+              The machines of the project are fetched once and identified by their unique name,
+              missing machines are then allocated (or existing ones released) concurrently.
+            - Every machine accepts name (required), id, hostname, description, ips, tags and userdata.
+              All other allocation parameters are taken from the module parameters.
+            - The result of every machine is returned in C(machines).
+        required: false
+    count:
+        description:
+            - Manages this number of machines named C(<name>-<n>), n starting with 1, like a list of machines.
+        required: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests when managing a list of machines.
+        default: 10
+    placement:
+        description:
+            - >-
+              Chooses the machines for a list of machines by their rack instead of letting the metal-api pick them.
+              The free machines of the partition and size are fetched once and grouped by rack.
+            - C(spread) distributes the machines evenly over all racks, C(pack) fills as few racks as possible.
+            - >-
+              If another allocation takes a chosen machine first, the next free machine is tried.
+              Machines with an id given are not placed.
+        default: none
+        choices:
+          - none
+          - spread
+          - pack
 
 author:
     - metal-stack
@@ -119,6 +170,44 @@ EXAMPLES = '''
   metal_machine:
     id: 306bc4ad-33cd-4744-8c6a-6b601f7179ea
     state: absent
+
+- name: allocate a machine and wait until it is ready
+  metal_machine:
+    name: my-machine
+    networks:
+    - internet
+    - 5d30b3af-cb2a-4aa3-84e8-52dbf94a326b
+    image: ubuntu-24.04
+    size: c1-xlarge-x86
+    partition: fra-equ01
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    wait: true
+    wait_timeout: 900
+
+- name: allocate the machines worker-1 to worker-50
+  metal_machine:
+    name: worker
+    count: 50
+    parallelism: 20
+    networks:
+    - internet
+    - 5d30b3af-cb2a-4aa3-84e8-52dbf94a326b
+    image: ubuntu-24.04
+    size: c1-xlarge-x86
+    partition: fra-equ01
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+
+- name: allocate three control plane machines in different racks
+  metal_machine:
+    name: control-plane
+    count: 3
+    placement: spread
+    networks:
+    - internet
+    image: ubuntu-24.04
+    size: c1-xlarge-x86
+    partition: fra-equ01
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
 '''
 
 RETURN = '''
@@ -128,8 +217,128 @@ id:
   returned: always
   type: str
   sample: 306bc4ad-33cd-4744-8c6a-6b601f7179ea
+events:
+  description:
+    - the provisioning events of the machine observed while waiting, oldest event first
+  returned: when wait is true
+  type: list
+  sample: [{"time": "2024-01-01T00:00:00+00:00", "event": "Phoned Home", "message": "phoning home"}]
+machines:
+  description:
+    - the results of every machine when managing a list of machines
+  returned: when machines or count is given
+  type: list
+  sample: [{"name": "worker-1", "id": "306bc4ad-33cd-4744-8c6a-6b601f7179ea", "state": "present", "changed": true,
+            "rack": "rack-1"}]
 '''
 
+# tags maintained by the metal-api on allocation, which must not be removed by updates
+METAL_API_TAG_PREFIX = "machine.metal-stack.io/"
+
+
+def update_request(machine, description, tags):
+    """
+    returns the update request for an allocated machine and whether it changes anything.
+    description and tags are only compared when given.
+    """
+    if machine.allocation is None:
+        raise ValueError("machine %s is not allocated" % machine.id)
+
+    changed = False
+
+    if description is None:
+        description = machine.allocation.description
+    elif machine.allocation.description != description:
+        changed = True
+
+    if tags is None:
+        tags = list(machine.tags or [])
+    else:
+        tags = list(tags)
+        for tag in machine.tags or []:
+            if tag.startswith(METAL_API_TAG_PREFIX):
+                tags.append(tag)
+
+        tags.append(ANSIBLE_CI_MANAGED_TAG)
+        if sorted(set(machine.tags or [])) != sorted(set(tags)):
+            changed = True
+
+    r = models.V1MachineUpdateRequest(
+        id=machine.id,
+        description=description or "",
+        ssh_pub_keys=machine.allocation.ssh_pub_keys or [],
+        tags=tags,
+    )
+
+    return r, changed
+
+
+# number of free machines tried for one placed allocation before giving up
+PLACEMENT_ATTEMPTS = 3
+
+# status returned by the metal-api when the requested machine was taken by another allocation
+MACHINE_TAKEN_STATUS = 409
+
+
+class Placement(object):
+    """
+    hands out free machines by rack, either spread evenly over the racks or packed into as few racks as possible.
+    machines are taken under a lock, such that concurrent allocations never get the same candidate.
+    """
+
+    def __init__(self, machines, strategy):
+        self._lock = threading.Lock()
+        self._strategy = strategy
+        self._racks = dict()
+        for m in sorted(machines, key=lambda m: m.id):
+            self._racks.setdefault(m.rackid or "", list()).append(m.id)
+
+    @property
+    def free(self):
+        return sum(len(ids) for ids in self._racks.values())
+
+    def plan(self, count):
+        """
+        returns the preferred rack for each of count allocations
+        """
+        remaining = dict((rack, len(ids)) for rack, ids in self._racks.items())
+        used = dict((rack, 0) for rack in self._racks)
+
+        if self._strategy == "spread":
+            def key(rack):
+                return used[rack], -remaining[rack], rack
+        else:
+            def key(rack):
+                return used[rack] == 0, -remaining[rack], rack
+
+        racks = list()
+        for _ in range(count):
+            candidates = [rack for rack in remaining if remaining[rack] > 0]
+            if not candidates:
+                break
+            rack = min(candidates, key=key)
+            used[rack] += 1
+            remaining[rack] -= 1
+            racks.append(rack)
+        return racks
+
+    def take(self, rack):
+        """
+        returns a free machine of the given rack or, if there is none left, of the rack with most free machines
+        """
+        with self._lock:
+            if not self._racks.get(rack):
+                candidates = [r for r, ids in self._racks.items() if ids]
+                if not candidates:
+                    return None, None
+                rack = max(candidates, key=lambda r: (len(self._racks[r]), r))
+            return rack, self._racks[rack].pop(0)
+
+
+def is_free(machine):
+    state = getattr(machine.state, "value", machine.state)
+    return machine.allocation is None and not state and machine.liveliness == "Alive"
+
 
 class Instance(object):
     def __init__(self, module):
@@ -150,10 +359,14 @@ class Instance(object):
         self._networks = module.params.get('networks') if module.params.get('networks') else []
         self._ips = module.params.get('ips') if module.params.get('ips') else []
         self._tags = module.params.get('tags') if module.params.get('tags') else []
+        self._update_tags = module.params.get('tags')
         self._ssh_pub_keys = module.params.get('ssh_pub_keys')
         self._userdata = module.params.get('userdata')
         self._file_system_layout = module.params.get('filesystemlayout')
         self._state = module.params.get('state')
+        self._wait = module.params.get('wait')
+        self._wait_timeout = module.params.get('wait_timeout')
+        self.events = None
         self._driver = init_driver_for_module(self._module)
         self._api_client = MachineApi(api_client=self._driver.client)
 
@@ -167,16 +380,20 @@ class Instance(object):
         self._find()
 
         if self._state == "present":
-            if self._machine:
-                return
+            if self._machine and self._machine.allocation:
+                self._update()
+            else:
+                # a machine found by id, which is not allocated yet, is allocated with this id
+                self._allocate()
+                self.changed = True
 
-            self._allocate()
-            self.changed = True
+            if self._wait:
+                self._wait_for_ready()
 
         elif self._state == "absent":
             if not self.id:
                 self._module.fail_json(msg="id is a required argument when state is absent")
-            if self._machine:
+            if self._machine and self._machine.allocation:
                 self._free()
                 self.changed = True
 
@@ -206,22 +423,10 @@ class Instance(object):
             self.id = self._machine.id
 
     def _allocate(self):
-        networks = list()
-        for n in self._networks:
-            auto_acquire = True
-            network_id = n
-            if ":" in n:
-                network_id = n.split(":")[0]
-                mode = n.split(":")[-1]
-                if mode == "noauto":
-                    auto_acquire = False
-                elif mode == "auto":
-                    auto_acquire = True
-                else:
-                    self._module.fail_json(
-                        msg="network acquisition mode not supported: %s" % mode)
-
-            networks.append(models.V1MachineAllocationNetwork(autoacquire=auto_acquire, networkid=network_id))
+        try:
+            networks = allocation_networks(self._networks)
+        except ValueError as e:
+            self._module.fail_json(msg=str(e))
 
         self._tags.append(ANSIBLE_CI_MANAGED_TAG)
 
@@ -249,6 +454,40 @@ class Instance(object):
 
         self.id = self._machine.id
 
+    def _update(self):
+        r, changed = update_request(self._machine, self._description, self._update_tags)
+        if not changed:
+            return
+
+        try:
+            self._machine = self._api_client.update_machine(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+
+        self.changed = True
+
+    def _wait_for_ready(self):
+        failure = dict()
+
+        def ready():
+            try:
+                self._machine = self._api_client.find_machine(self.id)
+            except rest.ApiException as e:
+                self._module.fail_json(msg="request to metal-api failed", error=str(e))
+
+            self.events = provisioning_events(self._machine)
+            state, reason = provisioning_state(self._machine)
+            if state == "failed":
+                failure.update(reason=reason)
+            return state != "pending"
+
+        if not wait_until(ready, self._wait_timeout):
+            self._module.fail_json(msg="timeout waiting for machine to become ready", id=self.id,
+                                   changed=self.changed, events=self.events)
+        if failure:
+            self._module.fail_json(msg="machine provisioning failed: %s" % failure["reason"], id=self.id,
+                                   changed=self.changed, events=self.events)
+
     def _free(self):
         if ANSIBLE_CI_MANAGED_TAG not in self._machine.tags:
             self._module.fail_json(msg="entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_TAG,
@@ -261,6 +500,197 @@ class Instance(object):
             self._module.fail_json(msg="request to metal-api failed", error=str(e))
 
 
+class BulkInstance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._project = module.params.get('project')
+        self._partition = module.params.get('partition')
+        self._image = module.params.get('image')
+        self._size = module.params.get('size')
+        self._description = module.params.get('description')
+        self._networks = module.params.get('networks') if module.params.get('networks') else []
+        self._tags = module.params.get('tags') if module.params.get('tags') else []
+        self._update_tags = module.params.get('tags')
+        self._ssh_pub_keys = module.params.get('ssh_pub_keys')
+        self._userdata = module.params.get('userdata')
+        self._file_system_layout = module.params.get('filesystemlayout')
+        self._state = module.params.get('state')
+        self._parallelism = module.params.get('parallelism')
+        self._placement_strategy = module.params.get('placement')
+        self._placement = None
+        self._preferred_racks = dict()
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = MachineApi(api_client=self._driver.client)
+
+        if self._placement_strategy != "none" and (not self._partition or not self._size):
+            module.fail_json(msg="partition and size are required for placement")
+
+        if module.params.get('wait'):
+            module.fail_json(msg="wait is not supported with machines or count, use the metal_machine_wait module "
+                                 "to wait for the allocated machines")
+
+        self._machines = module.params.get('machines')
+        if self._machines is None:
+            if not module.params.get('name'):
+                module.fail_json(msg="name is required as name prefix when using count")
+            if module.params.get('count') < 0:
+                module.fail_json(msg="count must not be negative")
+            self._machines = [dict(name="%s-%d" % (module.params.get('name'), i))
+                              for i in range(1, module.params.get('count') + 1)]
+
+        names = [m['name'] for m in self._machines]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            module.fail_json(msg="machine names must be unique within the list of machines", names=duplicates)
+
+        try:
+            self._allocation_networks = allocation_networks(self._networks)
+        except ValueError as e:
+            module.fail_json(msg=str(e))
+
+    def run(self):
+        if self._module.check_mode or not self._machines:
+            return
+
+        r = models.V1MachineFindRequest(
+            allocation_project=self._project,
+        )
+        try:
+            existing = self._api_client.find_machines(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        by_name = dict()
+        for machine in existing:
+            by_name.setdefault(machine.allocation.name, list()).append(machine)
+
+        if self._placement_strategy != "none" and self._state == "present":
+            self._plan([item for item in self._machines if not item.get('id') and item['name'] not in by_name])
+
+        outcomes = run_concurrently(lambda item: self._apply(item, by_name.get(item['name'], [])),
+                                    self._machines, self._parallelism)
+
+        failed = False
+        for item, (result, error) in zip(self._machines, outcomes):
+            if error is not None:
+                failed = True
+                result = dict(name=item['name'], changed=False, failed=True, msg=str(error))
+            self.changed = self.changed or result['changed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all machines could be managed", changed=self.changed,
+                                   machines=self.results)
+
+    def _plan(self, items):
+        if not items:
+            return
+
+        r = models.V1MachineFindRequest(
+            partition_id=self._partition,
+            sizeid=self._size,
+        )
+        try:
+            machines = self._api_client.find_machines(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        self._placement = Placement([m for m in machines if is_free(m)], self._placement_strategy)
+        if self._placement.free < len(items):
+            self._module.fail_json(msg="not enough free machines for placement", partition=self._partition,
+                                   size=self._size, free=self._placement.free, required=len(items))
+
+        for item, rack in zip(items, self._placement.plan(len(items))):
+            self._preferred_racks[item['name']] = rack
+
+    def _allocate_placed(self, item, result):
+        error = None
+        for _ in range(PLACEMENT_ATTEMPTS):
+            rack, uuid = self._placement.take(self._preferred_racks[item['name']])
+            if uuid is None:
+                break
+
+            r = self._allocate_request(item)
+            r.uuid = uuid
+            try:
+                machine = self._api_client.allocate_machine(r)
+            except rest.ApiException as e:
+                if e.status != MACHINE_TAKEN_STATUS:
+                    raise
+                error = e
+                continue
+
+            result.update(id=machine.id, rack=rack, changed=True)
+            return result
+
+        if error is not None:
+            raise error
+        raise RuntimeError("no free machine left for %s" % item['name'])
+
+    def _apply(self, item, found):
+        name = item['name']
+        result = dict(name=name, state=self._state, id=None, changed=False)
+
+        if len(found) > 1:
+            raise RuntimeError("multiple machines of name '%s' exist in project '%s'. module idempotence depends on "
+                               "unique names within a project, please ensure unique names." % (name, self._project))
+
+        machine = found[0] if found else None
+
+        if self._state == "present":
+            if machine:
+                result.update(id=machine.id)
+                r, changed = update_request(machine,
+                                            item['description'] if item.get('description') else self._description,
+                                            item['tags'] if item.get('tags') is not None else self._update_tags)
+                if changed:
+                    self._api_client.update_machine(r)
+                    result.update(changed=True)
+                return result
+
+            if name in self._preferred_racks:
+                return self._allocate_placed(item, result)
+
+            machine = self._api_client.allocate_machine(self._allocate_request(item))
+            result.update(id=machine.id, changed=True)
+            return result
+
+        if machine:
+            if ANSIBLE_CI_MANAGED_TAG not in machine.tags:
+                raise RuntimeError("entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_TAG)
+            self._api_client.free_machine(machine.id)
+            result.update(id=machine.id, changed=True)
+
+        return result
+
+    def _allocate_request(self, item):
+        tags = item['tags'] if item.get('tags') else list(self._tags)
+
+        return models.V1MachineAllocateRequest(
+            uuid=item.get('id'),
+            name=item['name'],
+            description=item['description'] if item.get('description') else self._description,
+            hostname=item['hostname'] if item.get('hostname') else item['name'],
+            partitionid=self._partition,
+            projectid=self._project,
+            imageid=self._image,
+            ips=item['ips'] if item.get('ips') else [],
+            sizeid=self._size,
+            networks=self._allocation_networks,
+            tags=tags + [ANSIBLE_CI_MANAGED_TAG],
+            ssh_pub_keys=self._ssh_pub_keys,
+            user_data=item['userdata'] if item.get('userdata') else self._userdata,
+            filesystemlayoutid=self._file_system_layout,
+        )
+
+
 def main():
     argument_spec = AUTH_SPEC.copy()
     argument_spec.update(dict(
@@ -274,17 +704,37 @@ def main():
         size=dict(type='str', required=False),
         networks=dict(type='list', required=False),
         ips=dict(type='list', required=False),
-        tags=dict(type='list', default=list(), required=False),
+        tags=dict(type='list', required=False),
         ssh_pub_keys=dict(type='list', default=list(), required=False),
         userdata=dict(type='str', required=False),
         filesystemlayout=dict(type='str', required=False),
         state=dict(type='str', choices=['present', 'absent'], default='present'),
+        wait=dict(type='bool', default=False),
+        wait_timeout=dict(type='int', default=600),
+        machines=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            id=dict(type='str', required=False),
+            hostname=dict(type='str', required=False),
+            description=dict(type='str', required=False),
+            ips=dict(type='list', required=False),
+            tags=dict(type='list', required=False),
+            userdata=dict(type='str', required=False),
+        )),
+        count=dict(type='int', required=False),
+        parallelism=dict(type='int', default=10),
+        placement=dict(type='str', choices=['none', 'spread', 'pack'], default='none'),
     ))
     module = AnsibleModule(
         argument_spec=argument_spec,
         supports_check_mode=True,
+        mutually_exclusive=[('machines', 'count')],
     )
 
+    if module.params.get('machines') is not None or module.params.get('count') is not None:
+        instance = BulkInstance(module)
+        instance.run()
+        module.exit_json(changed=instance.changed, machines=instance.results)
+
     instance = Instance(module)
 
     instance.run()
@@ -293,6 +743,8 @@ def main():
         changed=instance.changed,
         id=instance.id,
     )
+    if instance.events is not None:
+        result.update(events=instance.events)
 
     module.exit_json(**result)
 
@@ -0,0 +1,195 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+try:
+    from metal_python.api import MachineApi
+    from metal_python import models
+    from metal_python import rest
+
+    METAL_PYTHON_AVAILABLE = True
+except ImportError:
+    METAL_PYTHON_AVAILABLE = False
+
+import time
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.metal import AUTH_SPEC, init_driver_for_module, wait_until, provisioning_events, \
+    provisioning_state
+
+ANSIBLE_METADATA = {
+    'metadata_version': '0.1',
+    'status': ['preview'],
+    'supported_by': 'community'
+}
+
+DOCUMENTATION = '''
+---
+module: metal_machine_wait
+
+short_description: A module to wait for metal machines to become ready
+
+version_added: "2.8"
+
+description:
+    - Waits until a set of machines finished provisioning.
+    - >-
+      All machines are polled with a single find request per interval, such that the number of requests
+      does not depend on the number of machines. The interval grows with exponential backoff.
+    - Returns when all machines are ready and fails as soon as one machine is in a crash loop or failed its reclaim.
+    - Requires metal_python to be installed.
+
+options:
+    ids:
+        description:
+            - The ids of the machines to wait for, instead of all machines of the project.
+        required: false
+    project:
+        description:
+            - Waits for all machines allocated in this project, or for the given ids among them.
+            - Every poll only requests the machines of this project.
+        required: true
+    timeout:
+        description:
+            - The number of seconds to wait for the machines to become ready.
+        default: 600
+    max_interval:
+        description:
+            - The maximum number of seconds between two polls.
+        default: 30
+
+author:
+    - metal-stack
+'''
+
+EXAMPLES = '''
+- name: wait for the machines of a project
+  metal_machine_wait:
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    timeout: 1200
+
+- name: wait for allocated machines
+  metal_machine_wait:
+    ids: "{{ allocation.machines | map(attribute='id') | list }}"
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+'''
+
+RETURN = '''
+machines:
+  description:
+    - the last observed state of every machine with its state transitions
+  returned: always
+  type: list
+  sample:
+    - id: 306bc4ad-33cd-4744-8c6a-6b601f7179ea
+      name: worker-1
+      state: ready
+      reason: null
+      transitions:
+        - state: pending
+          elapsed: 0.1
+          event: PXE Booting
+        - state: ready
+          elapsed: 312.7
+          event: Phoned Home
+polls:
+  description:
+    - the number of requests made to the metal-api
+  returned: always
+  type: int
+  sample: 12
+'''
+
+
+class Instance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self._ids = module.params.get('ids')
+        self._project = module.params.get('project')
+        self._timeout = module.params.get('timeout')
+        self._max_interval = module.params.get('max_interval')
+        self.polls = 0
+        self._machines = dict()
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = MachineApi(api_client=self._driver.client)
+
+        if self._ids:
+            for id in self._ids:
+                self._machines[id] = dict(id=id, name=None, state="missing", reason=None, transitions=list())
+
+    @property
+    def results(self):
+        return sorted(self._machines.values(), key=lambda m: (m["name"] or "", m["id"]))
+
+    def run(self):
+        start = time.monotonic()
+
+        if not wait_until(lambda: self._poll(time.monotonic() - start), self._timeout,
+                          max_delay=self._max_interval):
+            self._module.fail_json(msg="timeout waiting for machines to become ready", machines=self.results,
+                                   polls=self.polls)
+
+        failed = [m["id"] for m in self._machines.values() if m["state"] == "failed"]
+        if failed:
+            self._module.fail_json(msg="machine provisioning failed", ids=failed, machines=self.results,
+                                   polls=self.polls)
+
+    def _poll(self, elapsed):
+        r = models.V1MachineFindRequest(
+            allocation_project=self._project,
+        )
+        try:
+            machines = self._api_client.find_machines(r)
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+        self.polls += 1
+
+        for machine in machines:
+            if self._ids and machine.id not in self._machines:
+                continue
+            self._observe(machine, elapsed)
+
+        states = [m["state"] for m in self._machines.values()]
+        return "failed" in states or all(s == "ready" for s in states)
+
+    def _observe(self, machine, elapsed):
+        m = self._machines.setdefault(machine.id, dict(id=machine.id, name=None, state="missing", reason=None,
+                                                       transitions=list()))
+        m["name"] = machine.allocation.name if machine.allocation else None
+
+        state, reason = provisioning_state(machine)
+        if state == m["state"]:
+            return
+
+        events = provisioning_events(machine)
+        m.update(state=state, reason=reason)
+        m["transitions"].append(dict(
+            state=state,
+            elapsed=round(elapsed, 1),
+            event=events[-1]["event"] if events else None,
+        ))
+
+
+def main():
+    argument_spec = AUTH_SPEC.copy()
+    argument_spec.update(dict(
+        ids=dict(type='list', elements='str', required=False),
+        project=dict(type='str', required=True),
+        timeout=dict(type='int', default=600),
+        max_interval=dict(type='int', default=30),
+    ))
+    module = AnsibleModule(
+        argument_spec=argument_spec,
+        supports_check_mode=True,
+    )
+
+    instance = Instance(module)
+
+    instance.run()
+
+    module.exit_json(changed=False, machines=instance.results, polls=instance.polls)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ except ImportError:
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_LABEL, ANSIBLE_CI_MANAGED_KEY, \
-    ANSIBLE_CI_MANAGED_VALUE, init_driver_for_module
+    ANSIBLE_CI_MANAGED_VALUE, init_driver_for_module, run_concurrently
 
 ANSIBLE_METADATA = {
     'metadata_version': '0.1',
@@ -65,6 +65,21 @@ options:
         choices:
           - absent
           - present
+    networks:
+        description:
+            - >-
+              A list of networks to manage in a single module run. The networks are fetched once per
+              partition and project and identified by their unique name, then allocated, updated or freed
+              concurrently.
+            - >-
+              Every network accepts name (required), description, partition, project, shared, labels and state.
+              Partition, project, shared and state default to the module parameters.
+            - The result of every network is returned in C(networks).
+        required: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests when managing a list of networks.
+        default: 10
 
 author:
     - metal-stack
@@ -84,6 +99,17 @@ EXAMPLES = '''
     project: 6df6a987-922d-4c36-8cd9-5edbd1584f7a
     partition: fra-equ01
     state: absent
+
+- name: manage the private networks of a tenant
+  metal_network:
+    project: 9ec6882a-cd94-42a7-b667-ffaed43557c7
+    partition: fra-equ01
+    networks:
+    - name: storage
+    - name: backup
+      description: "backup network"
+    - name: legacy
+      state: absent
 '''
 
 RETURN = '''
@@ -99,10 +125,47 @@ prefixes:
     returned: always
     type: list
     sample: ["10.0.112.0/22"]
-
+networks:
+    description:
+        - the results of every network when managing a list of networks
+    returned: when networks is given
+    type: list
+    sample: [{"name": "storage", "partition": "fra-equ01", "project": "9ec6882a-cd94-42a7-b667-ffaed43557c7",
+              "state": "present", "id": "3e977e81-6ab5-4f28-b608-e7e94d62efb7", "prefixes": ["10.0.112.0/22"],
+              "changed": true}]
 '''
 
 
+def update_request(network, description, shared):
+    """
+    returns the update request for an existing network and whether it changes anything
+    """
+    changed = False
+    r = models.V1NetworkUpdateRequest(
+        id=network.id,
+    )
+
+    # the name cannot be updated because we use it for identifying the network
+
+    if network.description != description:
+        changed = True
+        r.description = description
+
+    if network.shared != shared:
+        changed = True
+        r.shared = shared
+
+    # this is not possible through edit token by now, therefore disabling
+    # https://github.com/metal-stack/metal-api/issues/150
+    # labels = self._labels.copy()
+    # labels.update(ANSIBLE_CI_MANAGED_LABEL)
+    # if self._network.labels != labels:
+    #     self.changed = True
+    #     r.labels = labels
+
+    return r, changed
+
+
 class Instance(object):
     def __init__(self, module):
         if not METAL_PYTHON_AVAILABLE:
@@ -171,27 +234,7 @@ class Instance(object):
             self.prefixes = self._network.prefixes
 
     def _update(self):
-        r = models.V1NetworkUpdateRequest(
-            id=self.id,
-        )
-
-        # the name cannot be updated because we use it for identifying the network
-
-        if self._network.description != self._description:
-            self.changed = True
-            r.description = self._description
-
-        if self._network.shared != self._shared:
-            self.changed = True
-            r.shared = self._shared
-
-        # this is not possible through edit token by now, therefore disabling
-        # https://github.com/metal-stack/metal-api/issues/150
-        # labels = self._labels.copy()
-        # labels.update(ANSIBLE_CI_MANAGED_LABEL)
-        # if self._network.labels != labels:
-        #     self.changed = True
-        #     r.labels = labels
+        r, self.changed = update_request(self._network, self._description, self._shared)
 
         if self.changed:
             try:
@@ -233,6 +276,110 @@ class Instance(object):
         self.prefixes = self._network.prefixes
 
 
+class BulkInstance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._parallelism = module.params.get('parallelism')
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = NetworkApi(api_client=self._driver.client)
+
+        self._networks = list()
+        for item in module.params.get('networks'):
+            n = dict(item)
+            for key in ('partition', 'project', 'shared', 'state'):
+                if n.get(key) is None:
+                    n[key] = module.params.get(key)
+            if n.get('labels') is None:
+                n['labels'] = module.params.get('labels')
+            if n['partition'] is None or n['project'] is None:
+                module.fail_json(msg="partition and project must be given for network %s" % n['name'])
+            self._networks.append(n)
+
+        keys = [(n['partition'], n['project'], n['name']) for n in self._networks]
+        duplicates = sorted(set(k[2] for k in keys if keys.count(k) > 1))
+        if duplicates:
+            module.fail_json(msg="network names must be unique within a project and partition", names=duplicates)
+
+    def run(self):
+        if self._module.check_mode:
+            return
+
+        scopes = sorted(set((n['partition'], n['project']) for n in self._networks))
+
+        def find(scope):
+            return self._api_client.find_networks(models.V1NetworkFindRequest(partitionid=scope[0],
+                                                                              projectid=scope[1]))
+
+        by_name = dict()
+        for scope, (networks, error) in zip(scopes, run_concurrently(find, scopes, self._parallelism)):
+            if error is not None:
+                self._module.fail_json(msg="request to metal-api failed", error=str(error))
+                return
+            for network in networks:
+                by_name.setdefault(scope + (network.name,), list()).append(network)
+
+        outcomes = run_concurrently(
+            lambda n: self._apply(n, by_name.get((n['partition'], n['project'], n['name']), [])),
+            self._networks, self._parallelism)
+
+        failed = False
+        for n, (result, error) in zip(self._networks, outcomes):
+            if error is not None:
+                failed = True
+                result = dict(name=n['name'], partition=n['partition'], project=n['project'], changed=False,
+                              failed=True, msg=str(error))
+            self.changed = self.changed or result['changed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all networks could be managed", changed=self.changed,
+                                   networks=self.results)
+
+    def _apply(self, n, found):
+        result = dict(name=n['name'], partition=n['partition'], project=n['project'], state=n['state'], id=None,
+                      prefixes=None, changed=False)
+
+        if len(found) > 1:
+            raise RuntimeError("network name is not unique within a project and partition, which is required when "
+                               "using this module")
+
+        network = found[0] if found else None
+
+        if n['state'] == "present":
+            if network:
+                r, changed = update_request(network, n.get('description'), n['shared'])
+                if changed:
+                    network = self._api_client.update_network(r)
+            else:
+                labels = n['labels'].copy()
+                labels.update(ANSIBLE_CI_MANAGED_LABEL)
+                network = self._api_client.allocate_network(models.V1NetworkAllocateRequest(
+                    description=n.get('description'),
+                    name=n['name'],
+                    labels=labels,
+                    shared=n['shared'],
+                    partitionid=n['partition'],
+                    projectid=n['project'],
+                ))
+                changed = True
+
+            result.update(id=network.id, prefixes=network.prefixes, changed=changed)
+            return result
+
+        if network:
+            if network.labels.get(ANSIBLE_CI_MANAGED_KEY) != ANSIBLE_CI_MANAGED_VALUE:
+                raise RuntimeError("entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_LABEL)
+            network = self._api_client.free_network(network.id)
+            result.update(id=network.id, prefixes=network.prefixes, changed=True)
+
+        return result
+
+
 def main():
     argument_spec = AUTH_SPEC.copy()
     argument_spec.update(dict(
@@ -244,12 +391,28 @@ def main():
         shared=dict(type='bool', default=False),
         labels=dict(type='dict', required=False, default=dict()),
         state=dict(type='str', choices=['present', 'absent'], default='present'),
+        networks=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            description=dict(type='str', required=False),
+            partition=dict(type='str', required=False),
+            project=dict(type='str', required=False),
+            shared=dict(type='bool', required=False),
+            labels=dict(type='dict', required=False),
+            state=dict(type='str', choices=['present', 'absent'], required=False),
+        )),
+        parallelism=dict(type='int', default=10),
     ))
     module = AnsibleModule(
         argument_spec=argument_spec,
         supports_check_mode=True,
+        mutually_exclusive=[('networks', 'id'), ('networks', 'name')],
     )
 
+    if module.params.get('networks'):
+        instance = BulkInstance(module)
+        instance.run()
+        module.exit_json(changed=instance.changed, networks=instance.results)
+
     instance = Instance(module)
 
     instance.run()
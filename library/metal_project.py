@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 try:
-    from metal_python.api import ProjectApi
+    from metal_python.api import ProjectApi, MachineApi, IpApi, NetworkApi
     from metal_python import models
     from metal_python import rest
 
@@ -12,7 +12,7 @@ except ImportError:
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.metal import AUTH_SPEC, ANSIBLE_CI_MANAGED_LABEL, ANSIBLE_CI_MANAGED_KEY, \
-    ANSIBLE_CI_MANAGED_VALUE, init_driver_for_module
+    ANSIBLE_CI_MANAGED_VALUE, ANSIBLE_CI_MANAGED_TAG, init_driver_for_module, run_concurrently, attached_ips
 
 ANSIBLE_METADATA = {
     'metadata_version': '0.1',
@@ -38,7 +38,8 @@ options:
             - >-
               The name of the project, which must be globally unique.
               Otherwise, the module cannot figure out if the project was already created or not.
-        required: true
+            - Required unless projects is given.
+        required: false
     description:
         description:
             - The description of the project.
@@ -61,6 +62,38 @@ options:
         choices:
           - absent
           - present
+    cascade:
+        description:
+            - >-
+              Releases the resources of the project before deleting it when state is absent.
+              Machines and firewalls are released first, then the ips not attached to these machines
+              and finally networks, with the requests of every stage running concurrently.
+            - >-
+              Only resources managed by these modules are released. If the project contains resources
+              not managed by these modules, the module fails before releasing anything.
+            - The released resources are returned in C(released).
+        default: false
+    projects:
+        description:
+            - >-
+              A catalog of projects to reconcile in a single module run. All projects are fetched once and
+              identified by their globally unique name, such that an item may also move a project to its tenant.
+              Creates, updates and deletes are then applied concurrently.
+            - >-
+              Every project accepts name (required), description, tenant, labels and state.
+              Tenant and state default to the module parameters.
+            - The result of every project is returned in C(projects).
+        required: false
+    prune:
+        description:
+            - >-
+              Deletes all projects of the tenant managed by this module which are not part of the catalog.
+              Requires tenant to be given.
+        default: false
+    parallelism:
+        description:
+            - The maximum number of concurrent requests when reconciling a catalog of projects.
+        default: 10
 
 author:
     - metal-stack
@@ -78,6 +111,18 @@ EXAMPLES = '''
   metal_project:
     name: my-project
     state: absent
+
+- name: tear down a project with all its machines, ips and networks
+  metal_project:
+    name: my-project
+    state: absent
+    cascade: true
+
+- name: reconcile the projects of a tenant
+  metal_project:
+    tenant: my-tenant
+    prune: true
+    projects: "{{ project_catalog }}"
 '''
 
 RETURN = '''
@@ -87,9 +132,54 @@ id:
     returned: always
     type: str
     sample: 3e977e81-6ab5-4f28-b608-e7e94d62efb7
+released:
+    description:
+        - the machines (including firewalls), ips and networks released before deleting the project
+    returned: when cascade is true and the project was deleted
+    type: dict
+    sample: {"machines": ["306bc4ad-33cd-4744-8c6a-6b601f7179ea"], "ips": ["212.34.83.5"],
+             "networks": ["3e977e81-6ab5-4f28-b608-e7e94d62efb7"]}
+projects:
+    description:
+        - the results of every project when reconciling a catalog of projects, including pruned projects
+    returned: when projects is given
+    type: list
+    sample: [{"name": "my-project", "state": "present", "id": "3e977e81-6ab5-4f28-b608-e7e94d62efb7",
+              "changed": true}]
 '''
 
 
+def update_request(project, description, tenant, labels):
+    """
+    returns the update request for an existing project and whether it changes anything
+    """
+    changed = False
+    meta = models.V1Meta(id=project.meta.id)
+    r = models.V1ProjectUpdateRequest(description=None, meta=meta, name=None, quotas=None, tenant_id=None)
+
+    if project.description != description:
+        changed = True
+        r.description = description
+
+    if project.tenant_id != tenant:
+        changed = True
+        r.tenant_id = tenant
+
+    if project.meta.labels != labels:
+        changed = True
+        meta.labels = labels
+
+    return r, changed
+
+
+def is_managed(project):
+    return (project.meta.annotations or {}).get(ANSIBLE_CI_MANAGED_KEY) == ANSIBLE_CI_MANAGED_VALUE
+
+
+def is_managed_network(network):
+    return (network.labels or {}).get(ANSIBLE_CI_MANAGED_KEY) == ANSIBLE_CI_MANAGED_VALUE
+
+
 class Instance(object):
     def __init__(self, module):
         if not METAL_PYTHON_AVAILABLE:
@@ -104,6 +194,9 @@ class Instance(object):
         self._tenant = module.params.get('tenant')
         self._labels = module.params.get('labels')
         self._state = module.params.get('state')
+        self._cascade = module.params.get('cascade')
+        self._parallelism = module.params.get('parallelism')
+        self.released = None
         self._driver = init_driver_for_module(self._module)
         self._api_client = ProjectApi(api_client=self._driver.client)
 
@@ -146,20 +239,7 @@ class Instance(object):
             self.id = self._project.meta.id
 
     def _update(self):
-        meta = models.V1Meta(id=self.id)
-        r = models.V1ProjectUpdateRequest(description=None, meta=meta, name=None, quotas=None, tenant_id=None)
-
-        if self._project.description != self._description:
-            self.changed = True
-            r.description = self._description
-
-        if self._project.tenant_id != self._tenant:
-            self.changed = True
-            r.tenant_id = self._tenant
-
-        if self._project.meta.labels != self._labels:
-            self.changed = True
-            meta.labels = self._labels
+        r, self.changed = update_request(self._project, self._description, self._tenant, self._labels)
 
         if self.changed:
             try:
@@ -186,10 +266,13 @@ class Instance(object):
         self.id = self._project.meta.id
 
     def _delete(self):
-        if self._project.meta.annotations.get(ANSIBLE_CI_MANAGED_KEY) != ANSIBLE_CI_MANAGED_VALUE:
+        if not is_managed(self._project):
             self._module.fail_json(msg="entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_LABEL,
                                    name=self._name)
 
+        if self._cascade:
+            self._release_resources()
+
         try:
             self._project = self._api_client.delete_project(self.id)
         except rest.ApiException as e:
@@ -197,21 +280,190 @@ class Instance(object):
 
         self.id = self._project.meta.id
 
+    def _release_resources(self):
+        machine_api = MachineApi(api_client=self._driver.client)
+        ip_api = IpApi(api_client=self._driver.client)
+        network_api = NetworkApi(api_client=self._driver.client)
+
+        try:
+            machines = machine_api.find_machines(models.V1MachineFindRequest(allocation_project=self.id))
+            ips = ip_api.find_i_ps(models.V1IPFindRequest(projectid=self.id))
+            networks = network_api.find_networks(models.V1NetworkFindRequest(projectid=self.id))
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        # ephemeral ips attached to a machine are released together with the machine
+        attached = attached_ips(machines)
+        ips = [ip for ip in ips if ip.type == "static" or ip.ipaddress not in attached]
+
+        unmanaged = dict(
+            machines=[m.id for m in machines if ANSIBLE_CI_MANAGED_TAG not in (m.tags or [])],
+            ips=[ip.ipaddress for ip in ips if ANSIBLE_CI_MANAGED_TAG not in (ip.tags or [])],
+            networks=[n.id for n in networks if not is_managed_network(n)],
+        )
+        if any(unmanaged.values()):
+            self._module.fail_json(msg="project contains resources not managed by ansible, which are not released",
+                                   name=self._name, unmanaged=unmanaged)
+
+        self.released = dict(machines=list(), ips=list(), networks=list())
+        stages = (
+            ("machines", [m.id for m in machines], machine_api.free_machine),
+            ("ips", [ip.ipaddress for ip in ips], ip_api.free_ip),
+            ("networks", [n.id for n in networks], network_api.free_network),
+        )
+        for stage, ids, free in stages:
+            errors = list()
+            for id, (_, error) in zip(ids, run_concurrently(free, ids, self._parallelism)):
+                if error is not None:
+                    errors.append("%s: %s" % (id, error))
+                else:
+                    self.released[stage].append(id)
+            if errors:
+                self._module.fail_json(msg="releasing %s of the project failed" % stage, name=self._name,
+                                       changed=any(self.released.values()), errors=errors,
+                                       released=self.released)
+
+
+class BulkInstance(object):
+    def __init__(self, module):
+        if not METAL_PYTHON_AVAILABLE:
+            raise RuntimeError("metal_python must be installed")
+
+        self._module = module
+        self.changed = False
+        self.results = list()
+        self._tenant = module.params.get('tenant')
+        self._prune = module.params.get('prune')
+        self._parallelism = module.params.get('parallelism')
+        self._driver = init_driver_for_module(self._module)
+        self._api_client = ProjectApi(api_client=self._driver.client)
+
+        if self._prune and not self._tenant:
+            module.fail_json(msg="tenant is required for pruning projects")
+
+        self._projects = list()
+        for item in module.params.get('projects'):
+            p = dict(item)
+            for key in ('tenant', 'state'):
+                if p.get(key) is None:
+                    p[key] = module.params.get(key)
+            self._projects.append(p)
+
+        names = [p['name'] for p in self._projects]
+        duplicates = sorted(set(n for n in names if names.count(n) > 1))
+        if duplicates:
+            module.fail_json(msg="project names must be unique within the catalog", names=duplicates)
+
+    def run(self):
+        if self._module.check_mode:
+            return
+
+        # project names are globally unique and catalog items may move a project to another tenant,
+        # so all projects are fetched and matched by name like in the single mode
+        try:
+            existing = self._api_client.find_projects(models.V1ProjectFindRequest()) or []
+        except rest.ApiException as e:
+            self._module.fail_json(msg="request to metal-api failed", error=str(e))
+            return
+
+        by_name = dict()
+        for project in existing:
+            by_name.setdefault(project.name, list()).append(project)
+
+        items = list(self._projects)
+        if self._prune:
+            catalog = set(p['name'] for p in self._projects)
+            for name in sorted(by_name):
+                found = by_name[name]
+                if name in catalog or any(p.tenant_id != self._tenant for p in found):
+                    continue
+                if all(is_managed(p) for p in found):
+                    items.append(dict(name=name, tenant=self._tenant, state="absent"))
+
+        outcomes = run_concurrently(lambda p: self._apply(p, by_name.get(p['name'], [])), items,
+                                    self._parallelism)
+
+        failed = False
+        for p, (result, error) in zip(items, outcomes):
+            if error is not None:
+                failed = True
+                result = dict(name=p['name'], changed=False, failed=True, msg=str(error))
+            self.changed = self.changed or result['changed']
+            self.results.append(result)
+
+        if failed:
+            self._module.fail_json(msg="not all projects could be reconciled", changed=self.changed,
+                                   projects=self.results)
+
+    def _apply(self, p, found):
+        result = dict(name=p['name'], state=p['state'], id=None, changed=False)
+
+        if len(found) > 1:
+            raise RuntimeError("project name is not globally unique, which is required when using this module")
+
+        project = found[0] if found else None
+
+        if p['state'] == "present":
+            if project:
+                r, changed = update_request(project, p.get('description'), p['tenant'], p.get('labels'))
+                if changed:
+                    self._api_client.update_project(r)
+                result.update(id=project.meta.id, changed=changed)
+                return result
+
+            project = self._api_client.create_project(models.V1ProjectCreateRequest(
+                description=p.get('description'),
+                meta=models.V1Meta(
+                    annotations=ANSIBLE_CI_MANAGED_LABEL,
+                    labels=p.get('labels'),
+                ),
+                name=p['name'],
+                tenant_id=p['tenant'],
+            ))
+            result.update(id=project.meta.id, changed=True)
+            return result
+
+        if project:
+            if not is_managed(project):
+                raise RuntimeError("entity does not have label attached: %s" % ANSIBLE_CI_MANAGED_LABEL)
+            self._api_client.delete_project(project.meta.id)
+            result.update(id=project.meta.id, changed=True)
+
+        return result
+
 
 def main():
     argument_spec = AUTH_SPEC.copy()
     argument_spec.update(dict(
-        name=dict(type='str', required=True),
+        name=dict(type='str', required=False),
         tenant=dict(type='str', required=False),
         description=dict(type='str', required=False),
         labels=dict(type='list', required=False),
         state=dict(type='str', choices=['present', 'absent'], default='present'),
+        projects=dict(type='list', elements='dict', required=False, options=dict(
+            name=dict(type='str', required=True),
+            description=dict(type='str', required=False),
+            tenant=dict(type='str', required=False),
+            labels=dict(type='list', required=False),
+            state=dict(type='str', choices=['present', 'absent'], required=False),
+        )),
+        cascade=dict(type='bool', default=False),
+        prune=dict(type='bool', default=False),
+        parallelism=dict(type='int', default=10),
     ))
     module = AnsibleModule(
         argument_spec=argument_spec,
         supports_check_mode=True,
+        required_one_of=[('name', 'projects')],
+        mutually_exclusive=[('name', 'projects')],
     )
 
+    if module.params.get('projects'):
+        instance = BulkInstance(module)
+        instance.run()
+        module.exit_json(changed=instance.changed, projects=instance.results)
+
     instance = Instance(module)
 
     instance.run()
@@ -220,6 +472,8 @@ def main():
         changed=instance.changed,
         id=instance.id,
     )
+    if instance.released is not None:
+        result.update(released=instance.released)
 
     module.exit_json(**result)
 
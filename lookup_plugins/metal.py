@@ -1,12 +1,26 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
 
+import copy
+import errno
+import fcntl
+import hashlib
+import json
 import os
+import pickle
+import tempfile
+import threading
+import time
 from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 try:
     import metal_python.api as apis
     from metal_python import models
+    from metal_python import rest
     from metal_python.driver import Driver
 
     METAL_PYTHON_AVAILABLE = True
@@ -14,7 +28,11 @@ except ImportError:
     METAL_PYTHON_AVAILABLE = False
 
 from ansible.errors import AnsibleError
+from ansible.module_utils.parsing.convert_bool import boolean
 from ansible.plugins.lookup import LookupBase
+from ansible.utils.display import Display
+
+display = Display()
 
 DOCUMENTATION = """
     lookup: metal
@@ -27,9 +45,11 @@ DOCUMENTATION = """
     options:
       request:
         description:
-        - The type of the request (get or search).
+        - The type of the request (get, search or exists).
         - "'get' returns a single result and needs the primary key to be added as the query term"
         - "'search' returns a list of results filtered by the given query params"
+        - "'exists' returns whether the entity with the given primary key exists"
+        - "'latest' returns the newest usable image of an operating system, see C(query)"
         default: get
       entity:
         description: the entity to lookup
@@ -42,9 +62,122 @@ DOCUMENTATION = """
       query:
         description:
           - Arbitrary query parameters passed on to the get request or request search body
+          - For 'get', the id can also be a list of ids, which are fetched concurrently and returned in the same order.
+          - >-
+            For 'latest', C(os) selects the operating system, the optional C(version) a version prefix (e.g. C(24.04))
+            and the optional C(feature) an image feature (e.g. C(machine)). Expired images are never returned.
+          - >-
+            The metal-api can only list all images, partitions, sizes and switches. For these entities, search queries
+            are applied by the lookup on an index of the (cached) entity list, e.g. C(features='machine') or
+            C(labels={'key': 'value'}). Nested entities like the partition of a switch are matched by their id.
           - It can be that certain query parameters overlap with the Ansible lookup plugin constructor (e.g. 'name').
           - If this happens, you can prefix your parameter with an underscore, which will be removed before the request.
         required: False
+      cache:
+        description:
+          - Memoize lookup results within the worker process.
+          - Identical lookups (same API URL, credentials, entity, request type and query) are only sent to the API once within C(cache_ttl).
+          - The frequently changing entities firewall, ip and machine are not memoized by default, such that polling them with C(until) and C(retries) sees every change. Set C(cache_ttls) to memoize them as well.
+        type: bool
+        default: True
+      cache_ttl:
+        description:
+          - Seconds a memoized lookup result stays valid.
+          - Applies to all entities that are not configured through C(cache_ttls).
+        type: int
+        default: 60
+      cache_ttls:
+        description:
+          - Seconds a memoized lookup result stays valid per entity, e.g. C({"machine": 10}).
+          - The rarely changing entities image, partition and size default to 300 seconds.
+          - The frequently changing entities firewall, ip and machine default to 0 seconds, which disables memoizing their results. Missing entities are still cached for C(negative_cache_ttl).
+        type: dict
+      cache_size:
+        description: Maximum number of memoized lookup results, the least recently used result is evicted first.
+        type: int
+        default: 256
+      cache_dir:
+        description:
+          - Directory of a cache shared by all worker processes on the controller.
+          - If set, a lookup result is only fetched by one worker while concurrent workers wait for it to be written.
+          - Can also be set through the variable C(metal_lookup_cache_dir) or the environment variable C(METAL_LOOKUP_CACHE_DIR).
+          - If not set, results are only memoized within a worker process.
+        type: path
+      cache_max_bytes:
+        description: Maximum size of the cache directory, the oldest entries are evicted first.
+        type: int
+        default: 67108864
+      cache_lock_timeout:
+        description: Seconds to wait for another worker fetching the same lookup result before fetching it without the lock.
+        type: int
+        default: 60
+      fields:
+        description:
+          - Only return the given fields of an entity, nested fields are separated by dots (e.g. C(allocation.hostname)).
+          - Fields within lists are selected for every element of the list (e.g. C(allocation.networks.networkid)).
+          - Only the selected fields are converted, which is considerably cheaper for large entities like machines.
+          - C(projection) is an alias of this option.
+        type: list
+      raw:
+        description:
+          - Converts the json response of the metal-api directly into the result instead of deserializing it into
+            metal-python models and converting these with to_dict().
+          - The result has the same structure as without this option, but date-times are returned as ISO 8601 strings.
+          - This roughly halves the CPU time of lookups returning many machines or switches.
+        type: bool
+        default: False
+      join:
+        description:
+          - Adds the referenced entities to every result, the referenced entity collections are fetched concurrently
+            with a single search each and joined by id.
+          - "machine and firewall: C(project), C(networks) and C(ips)"
+          - "ip: C(project) and C(network)"
+          - "network: C(project), C(partition) and C(parent)"
+          - Fields of joined entities can be selected with C(fields), e.g. C(project.name).
+        type: list
+      negative_cache_ttl:
+        description:
+          - Seconds to remember that an entity does not exist, such that repeated gets and existence checks of missing
+            entities do not reach the API. Set to 0 to disable.
+        type: int
+        default: 10
+      max_workers:
+        description: Maximum number of concurrent requests when fetching a list of ids.
+        type: int
+        default: 8
+      on_missing:
+        description:
+          - What to do if an id of a list of ids does not exist or no image matches a 'latest' request.
+          - C(fail) fails the lookup, C(skip) leaves the id out of the result and C(none) returns null in its place.
+        default: fail
+        choices:
+          - fail
+          - skip
+          - none
+      endpoints:
+        description:
+          - A list of metal-apis to run the lookup against concurrently, instead of the single API given by C(api_url).
+          - Every endpoint is a dict of C(api_url) and C(api_token) or C(api_hmac) and C(api_hmac_user), and an optional C(name).
+          - The results of all endpoints are merged into a single list, every result is tagged with the name (defaults to the url) of its endpoint in the C(endpoint) field.
+          - For 'exists', a dict of endpoint names to the existence of the entity is returned.
+          - >-
+            Can also be set through the variable C(metal_api_endpoints), which is ignored when C(api_url) is given
+            to the lookup. Set to C(None) to query the single API only.
+        type: list
+      endpoint_errors:
+        description:
+          - C(fail) fails the lookup if any endpoint failed, listing the error of every failed endpoint.
+          - C(warn) emits a warning for every failed endpoint and returns the results of the other endpoints.
+        default: fail
+        choices:
+          - fail
+          - warn
+      connection_pool_size:
+        description:
+          - Maximum number of connections kept alive to the metal-api.
+          - Drivers are reused across lookups of a worker process with the same API URL and credentials, so connections are only established once.
+          - Defaults to the metal-python client default.
+        type: int
     requirements:
       - "metal-python >= 0.9.0"
     notes:
@@ -55,152 +188,738 @@ EXAMPLES = """
 - name: Fetch a list of partition
   set_fact:
     projects: "{{ lookup('metal', request='search', entity='partition') }}"
+
+- name: Fetch all machines of a cluster, ignoring machines that do not exist (anymore)
+  set_fact:
+    machines: "{{ lookup('metal', 'get', 'machine', id=machine_ids, on_missing='skip') }}"
+
+- name: Fetch the switches of a partition
+  set_fact:
+    switches: "{{ lookup('metal', 'search', 'switch', partition='fra-equ01') }}"
+
+- name: Fetch the names and networks of the machines of a project
+  set_fact:
+    machines: "{{ lookup('metal', 'search', 'machine', allocation_project=project_id, fields=['id', 'allocation.name', 'allocation.networks.networkid']) }}"
+
+- name: Fetch all machines of a partition without deserializing them into models
+  set_fact:
+    machines: "{{ lookup('metal', 'search', 'machine', partition_id='fra-equ01', raw=True) }}"
+
+- name: Fetch the machines of a project together with their project, networks and ips
+  set_fact:
+    machines: "{{ lookup('metal', 'search', 'machine', allocation_project=project_id, join=['project', 'networks', 'ips']) }}"
+
+- name: Fetch the machines of all regions
+  set_fact:
+    machines: "{{ lookup('metal', 'search', 'machine', endpoints=metal_regions, endpoint_errors='warn') }}"
+  vars:
+    metal_regions:
+      - name: fra
+        api_url: https://api.fra.metal-stack.io/metal
+        api_token: "{{ fra_token }}"
+      - name: muc
+        api_url: https://api.muc.metal-stack.io/metal
+        api_token: "{{ muc_token }}"
+
+- name: Fetch the newest ubuntu 24.04 machine image
+  set_fact:
+    image: "{{ lookup('metal', 'latest', 'image', os='ubuntu', version='24.04', feature='machine') }}"
+
+- name: Check if a machine exists
+  set_fact:
+    machine_exists: "{{ lookup('metal', 'exists', 'machine', id=machine_id) }}"
+
+- name: Fetch an image without using memoized results
+  set_fact:
+    image: "{{ lookup('metal', 'get', 'image', id='ubuntu-24.04', cache=False) }}"
 """
 
 
+class LRUCache(object):
+    """
+    A thread-safe LRU cache with a time-to-live for every entry.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        returns a tuple of (hit, value)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return False, None
+
+            self._entries.move_to_end(key)
+            return True, value
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_memo = LRUCache()
+
+
+def credential_identity(token, hmac, hmac_user):
+    """
+    identifies the credentials used for a request without keeping the secrets in memory
+    """
+    h = hashlib.sha256()
+    for part in (token, hmac, hmac_user):
+        h.update((part or "").encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def cache_key(url, credentials, entity, request, query, fields=None, raw=False):
+    return (url, credentials, entity, request, json.dumps(query, sort_keys=True, default=str),
+            json.dumps(sorted(fields) if fields else None), raw)
+
+
+def projection_tree(fields):
+    """
+    turns a list of dotted field paths into a tree, a leaf (None) selects the entire value
+    """
+    tree = dict()
+    for field in fields:
+        node = tree
+        parts = field.split(".")
+        for i, part in enumerate(parts):
+            if i == len(parts) - 1:
+                node[part] = None
+                break
+            if part in node and node[part] is None:
+                # a shorter path already selects the entire value
+                break
+            node = node.setdefault(part, dict())
+    return tree
+
+
+def to_plain(value):
+    if hasattr(value, "to_dict"):
+        return value.to_dict()
+    if isinstance(value, list):
+        return [to_plain(v) for v in value]
+    if isinstance(value, dict):
+        return {k: to_plain(v) for k, v in value.items()}
+    return value
+
+
+def project(value, tree):
+    """
+    converts only the fields selected by the projection tree, lists are projected element-wise.
+    """
+    if tree is None:
+        return to_plain(value)
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return [project(v, tree) for v in value]
+
+    result = dict()
+    for name, sub in tree.items():
+        if isinstance(value, dict):
+            if name not in value:
+                continue
+            result[name] = project(value[name], sub)
+            continue
+
+        swagger_types = getattr(value, "swagger_types", None)
+        if swagger_types is None:
+            raise AnsibleError("field %s cannot be selected from a value of type %s" % (name, type(value).__name__))
+        if name not in swagger_types:
+            raise _unknown_field(type(value), name)
+        result[name] = project(getattr(value, name), sub)
+
+    return result
+
+
+# cached in place of entities that do not exist
+MISSING = {"__metal_lookup_missing__": True}
+
+
+def _index_token(value):
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, sort_keys=True, default=str)
+    return value
+
+
+def _unknown_field(model, name):
+    return AnsibleError("%s has no field %s, available fields are: %s"
+                        % (model.__name__, name, ", ".join(sorted(model.swagger_types))))
+
+
+def from_raw(data, type_name, tree=None):
+    """
+    converts a decoded json response of the given swagger type into the same dict as the to_dict() of the
+    deserialized model, without instantiating any models. if a projection tree is given, only the selected
+    fields are converted. datetimes are kept as strings.
+    """
+    if data is None:
+        return None
+    if type_name.startswith("list["):
+        return [from_raw(d, type_name[5:-1], tree) for d in data]
+    if type_name.startswith("dict("):
+        value_type = type_name[5:-1].split(", ", 1)[1]
+        return {k: from_raw(v, value_type) for k, v in data.items()}
+
+    model = getattr(models, type_name, None)
+    if model is None:
+        return data
+
+    if tree is None:
+        return {attr: from_raw(data.get(key), model.swagger_types[attr])
+                for attr, key in model.attribute_map.items()}
+
+    result = dict()
+    for name, sub in tree.items():
+        if name not in model.attribute_map:
+            raise _unknown_field(model, name)
+        result[name] = from_raw(data.get(model.attribute_map[name]), model.swagger_types[name], sub)
+    return result
+
+
+class EntityIndex(object):
+    """
+    An inverted index over a list of entities for answering search queries without the API.
+
+    Postings are built lazily per field on the first query using this field:
+      - scalar fields are matched by equality
+      - list fields match if they contain the queried value(s)
+      - dict fields (e.g. labels) match if they contain all queried key value pairs
+      - nested entities (e.g. the partition of a switch) are matched by their id
+    """
+
+    def __init__(self, entities):
+        self.entities = entities
+        self._postings = dict()
+        self._lock = threading.Lock()
+
+    def _build(self, field):
+        postings = dict()
+        for i, e in enumerate(self.entities):
+            value = e.get(field)
+            if isinstance(value, list):
+                tokens = [_index_token(v) for v in value]
+            elif isinstance(value, dict) and "id" in value:
+                tokens = [value["id"]]
+            elif isinstance(value, dict):
+                tokens = [(k, _index_token(v)) for k, v in value.items()]
+            else:
+                tokens = [_index_token(value)]
+
+            # an empty filter does not filter at all
+            if not tokens:
+                continue
+
+            for token in tokens:
+                postings.setdefault(token, set()).add(i)
+        return postings
+
+    def postings(self, field):
+        with self._lock:
+            if field not in self._postings:
+                if self.entities and not any(field in e for e in self.entities):
+                    raise AnsibleError("unknown search field %s, available fields are: %s"
+                                       % (field, ", ".join(sorted(self.entities[0]))))
+                self._postings[field] = self._build(field)
+            return self._postings[field]
+
+    def search(self, **query):
+        matches = None
+        for field, value in query.items():
+            postings = self.postings(field)
+
+            if isinstance(value, dict):
+                tokens = [(k, _index_token(v)) for k, v in value.items()]
+            elif isinstance(value, list):
+                tokens = [_index_token(v) for v in value]
+            else:
+                tokens = [_index_token(value)]
+
+            # an empty filter does not filter at all
+            if not tokens:
+                continue
+
+            for token in tokens:
+                hits = postings.get(token, set())
+                matches = hits if matches is None else matches & hits
+
+            if not matches:
+                return list()
+
+        if matches is None:
+            return list(self.entities)
+
+        return [self.entities[i] for i in sorted(matches)]
+
+
+def field_values(value, path):
+    """
+    returns the values at a dotted path and whether the path led through a list
+    """
+    values, many = [value], False
+    for part in path.split("."):
+        selected = list()
+        for v in values:
+            v = v.get(part) if isinstance(v, dict) else None
+            if isinstance(v, list):
+                many = True
+                selected.extend(v)
+            elif v is not None:
+                selected.append(v)
+        values = selected
+    return values, many
+
+
+def hash_join(entities, relation, targets, foreign_key, key):
+    """
+    adds the targets referenced by the foreign key of every entity under the name of the relation
+    """
+    by_key = dict()
+    for t in targets:
+        values, _ = field_values(t, key)
+        if values:
+            by_key[values[0]] = t
+
+    for e in entities:
+        values, many = field_values(e, foreign_key)
+        if many:
+            e[relation] = [by_key[v] for v in values if v in by_key]
+        else:
+            e[relation] = by_key.get(values[0]) if values else None
+
+
+def parse_image_id(id):
+    """
+    splits an image id like ubuntu-24.04.20240521 into the os and its version tuple,
+    returns None if the id does not follow this scheme
+    """
+    os_name, sep, version = id.rpartition("-")
+    if not sep or not os_name:
+        return None
+    try:
+        return os_name, parse_version(version)
+    except ValueError:
+        return None
+
+
+def parse_version(version):
+    return tuple(int(v) for v in version.split("."))
+
+
+def _as_datetime(value):
+    if value is None or isinstance(value, datetime):
+        d = value
+    else:
+        d = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if d is not None and d.tzinfo is None:
+        d = d.replace(tzinfo=timezone.utc)
+    return d
+
+
+class ImageIndex(object):
+    """
+    Sorted versions of the non-expired images per os and per os and feature for resolving
+    the latest image matching a version prefix with a binary search.
+    """
+
+    def __init__(self, images, now=None):
+        now = now if now else datetime.now(timezone.utc)
+        self._versions = dict()
+
+        for image in images:
+            expiration = _as_datetime(image.get("expiration_date"))
+            if expiration is not None and expiration < now:
+                continue
+
+            parsed = parse_image_id(image["id"])
+            if parsed is None:
+                continue
+            os_name, version = parsed
+
+            for feature in [None] + list(image.get("features") or []):
+                self._versions.setdefault((os_name, feature), list()).append((version, image["id"], image))
+
+        for versions in self._versions.values():
+            versions.sort(key=lambda v: (v[0], v[1]))
+        self._keys = {k: [v[0] for v in versions] for k, versions in self._versions.items()}
+
+    def latest(self, os_name, version=None, feature=None):
+        versions = self._versions.get((os_name, feature))
+        if not versions:
+            return None
+
+        if not version:
+            return versions[-1][2]
+
+        prefix = parse_version(str(version))
+        upper = prefix[:-1] + (prefix[-1] + 1,)
+        keys = self._keys[(os_name, feature)]
+
+        lo = bisect_left(keys, prefix)
+        hi = bisect_left(keys, upper)
+        if lo == hi:
+            return None
+        return versions[hi - 1][2]
+
+
+class _CacheEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, datetime):
+            return {"__datetime__": o.isoformat()}
+        return super().default(o)
+
+
+def _decode_cache_object(o):
+    if len(o) == 1 and "__datetime__" in o:
+        return datetime.fromisoformat(o["__datetime__"])
+    return o
+
+
+class DiskCache(object):
+    """
+    A cache shared between the forked Ansible workers.
+
+    Every entry is stored in its own file, which is replaced atomically. Fetching an entry is guarded by a
+    lock file, such that only one worker sends the request while the others wait for the written result.
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024, lock_timeout=60):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.lock_timeout = lock_timeout
+        os.makedirs(self.path, mode=0o700, exist_ok=True)
+
+    def _file(self, key, suffix):
+        digest = hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest + suffix)
+
+    def get(self, key):
+        """
+        returns a tuple of (hit, value)
+        """
+        try:
+            with open(self._file(key, ".json"), "r") as f:
+                entry = json.load(f, object_hook=_decode_cache_object)
+        except (OSError, ValueError):
+            return False, None
+
+        if entry.get("expires", 0) < time.time():
+            return False, None
+
+        return True, entry.get("value")
+
+    def put(self, key, value, ttl):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(dict(expires=time.time() + ttl, value=value), f, cls=_CacheEncoder)
+            os.replace(tmp, self._file(key, ".json"))
+        except Exception:
+            os.unlink(tmp)
+            raise
+
+        self._evict()
+
+    def get_or_fetch(self, key, ttl, fetch):
+        """
+        ttl can also be a function returning the ttl of the fetched value
+        """
+        hit, value = self.get(key)
+        if hit:
+            return value
+
+        with open(self._file(key, ".lock"), "w") as lock:
+            locked = self._lock(lock, self.lock_timeout)
+            try:
+                # another worker may have fetched the result while we were waiting for the lock
+                hit, value = self.get(key)
+                if hit:
+                    return value
+
+                value = fetch()
+                self.put(key, value, ttl(value) if callable(ttl) else ttl)
+                return value
+            finally:
+                if locked:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _lock(f, timeout):
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return True
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+
+    def _evict(self):
+        with open(os.path.join(self.path, "evict.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                entries = list()
+                total = 0
+                for entry in os.scandir(self.path):
+                    if not entry.name.endswith(".json"):
+                        continue
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+                entries.sort()
+                for _, size, path in entries:
+                    if total <= self.max_bytes:
+                        break
+                    try:
+                        os.unlink(path)
+                        os.unlink(path[:-len(".json")] + ".lock")
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+_pool_lock = threading.Lock()
+_drivers = dict()
+_requesters = dict()
+
+
+def pooled_requester(entity, url, token, hmac, hmac_user, pool_size=None):
+    """
+    returns a requester for the given entity, which shares its driver and http connection pool
+    with all previous lookups against the same API URL with the same credentials.
+    """
+    driver_key = (url, credential_identity(token, hmac, hmac_user), pool_size)
+
+    with _pool_lock:
+        requester = _requesters.get((driver_key, entity))
+        if requester is not None:
+            return requester
+
+        d = _drivers.get(driver_key)
+        if d is None:
+            d = Driver(url, token, hmac, hmac_user=hmac_user)
+            if pool_size:
+                d.config.connection_pool_maxsize = pool_size
+                d.client.rest_client = rest.RESTClientObject(d.config)
+            _drivers[driver_key] = d
+
+        requester = LookupModule._entities[entity](client=d.client)
+        _requesters[(driver_key, entity)] = requester
+        return requester
+
+
 class Requester(ABC):
+    # the name of the response model of this entity
+    model = None
+    # the api of this entity only allows listing all entities, search queries are applied by the lookup
+    client_side_search = False
+
     @abstractmethod
     def __init__(self, _):
         pass
 
+    @staticmethod
+    def _call(method, raw, *args, **kwargs):
+        """
+        returns the deserialized models or, if raw is set, the decoded json response
+        """
+        if not raw:
+            return method(*args, **kwargs)
+
+        response = method(*args, _preload_content=False, **kwargs)
+        try:
+            return json.loads(response.data)
+        finally:
+            response.release_conn()
+
     @abstractmethod
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         pass
 
     @abstractmethod
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         pass
 
 
 class PartitionRequester(Requester):
+    model = "V1PartitionResponse"
+    client_side_search = True
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.PartitionApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_partition(id=kwargs.get("id"))
+        return self._call(self.api.find_partition, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
-        return self.api.list_partitions()
+    def search(self, raw=False, **kwargs):
+        return self._call(self.api.list_partitions, raw)
 
 
 class SizeRequester(Requester):
+    model = "V1SizeResponse"
+    client_side_search = True
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.SizeApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_size(id=kwargs.get("id"))
+        return self._call(self.api.find_size, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
-        return self.api.list_sizes()
+    def search(self, raw=False, **kwargs):
+        return self._call(self.api.list_sizes, raw)
 
 
 class MachineRequester(Requester):
+    model = "V1MachineResponse"
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.MachineApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_machine(id=kwargs.get("id"))
+        return self._call(self.api.find_machine, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         body = models.V1MachineFindRequest(**kwargs)
-        return self.api.find_machines(body)
+        return self._call(self.api.find_machines, raw, body)
 
 
 class NetworkRequester(Requester):
+    model = "V1NetworkResponse"
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.NetworkApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_network(id=kwargs.get("id"))
+        return self._call(self.api.find_network, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         body = models.V1NetworkFindRequest(**kwargs)
-        return self.api.find_networks(body)
+        return self._call(self.api.find_networks, raw, body)
 
 
 class IPRequester(Requester):
+    model = "V1IPResponse"
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.IpApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_ip(id=kwargs.get("id"))
+        return self._call(self.api.find_ip, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         body = models.V1IPFindRequest(**kwargs)
-        return self.api.find_i_ps(body)
+        return self._call(self.api.find_i_ps, raw, body)
 
 
 class FirewallRequester(Requester):
+    model = "V1FirewallResponse"
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.FirewallApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_firewall(id=kwargs.get("id"))
+        return self._call(self.api.find_firewall, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         body = models.V1FirewallFindRequest(**kwargs)
-        return self.api.find_firewalls(body)
+        return self._call(self.api.find_firewalls, raw, body)
 
 
 class ImageRequester(Requester):
+    model = "V1ImageResponse"
+    client_side_search = True
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.ImageApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_image(id=kwargs.get("id"))
+        return self._call(self.api.find_image, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
-        return self.api.list_images()
+    def search(self, raw=False, **kwargs):
+        return self._call(self.api.list_images, raw)
 
 
 class ProjectRequester(Requester):
+    model = "V1ProjectResponse"
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.ProjectApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_project(id=kwargs.get("id"))
+        return self._call(self.api.find_project, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
+    def search(self, raw=False, **kwargs):
         body = models.V1ProjectFindRequest(**kwargs)
-        return self.api.find_projects(body)
+        return self._call(self.api.find_projects, raw, body)
 
 
 class SwitchRequester(Requester):
+    model = "V1SwitchResponse"
+    client_side_search = True
+
     def __init__(self, client):
         super().__init__(client)
         self.api = apis.SwitchApi(api_client=client)
 
-    def get(self, **kwargs):
+    def get(self, raw=False, **kwargs):
         if "id" not in kwargs:
             raise AnsibleError("id must be present")
-        return self.api.find_switch(id=kwargs.get("id"))
+        return self._call(self.api.find_switch, raw, id=kwargs.get("id"))
 
-    def search(self, **kwargs):
-        return self.api.list_switches()
+    def search(self, raw=False, **kwargs):
+        return self._call(self.api.list_switches, raw)
 
 
 class LookupModule(LookupBase):
@@ -215,16 +934,59 @@ class LookupModule(LookupBase):
         size=SizeRequester,
         switch=SwitchRequester,
     )
-    _request_types = ["get", "search"]
+    _request_types = ["get", "search", "exists", "latest"]
+    _cache_ttls = dict(
+        firewall=0,
+        image=300,
+        ip=0,
+        machine=0,
+        partition=300,
+        size=300,
+    )
+    _on_missing = ["fail", "skip", "none"]
+    _endpoint_errors = ["fail", "warn"]
+    # relation name: (target entity, foreign key in the entity, key in the target, {query key: target query key})
+    # the query mapping narrows down the fetched targets if the entities were searched by this query key
+    _relations = dict(
+        firewall=dict(
+            project=("project", "allocation.project", "meta.id", dict()),
+            networks=("network", "allocation.networks.networkid", "id", dict()),
+            ips=("ip", "allocation.networks.ips", "ipaddress", dict(allocation_project="projectid")),
+        ),
+        ip=dict(
+            project=("project", "projectid", "meta.id", dict()),
+            network=("network", "networkid", "id", dict()),
+        ),
+        machine=dict(
+            project=("project", "allocation.project", "meta.id", dict()),
+            networks=("network", "allocation.networks.networkid", "id", dict()),
+            ips=("ip", "allocation.networks.ips", "ipaddress", dict(allocation_project="projectid")),
+        ),
+        network=dict(
+            project=("project", "projectid", "meta.id", dict()),
+            partition=("partition", "partitionid", "id", dict()),
+            parent=("network", "parentnetworkid", "id", dict()),
+        ),
+    )
 
     def run(self, terms, variables=None, **kwargs):
         if not METAL_PYTHON_AVAILABLE:
             raise RuntimeError("metal_python must be installed")
 
-        url = kwargs.pop("api_url", variables.get("metal_api_url", os.environ.get("METALCTL_API_URL")))
-        hmac = kwargs.pop("api_hmac", variables.get("metal_api_hmac", os.environ.get("METALCTL_HMAC")))
-        hmac_user = kwargs.pop("api_hmac_user", variables.get("metal_api_hmac_user", "Metal-Edit"))
-        token = kwargs.pop("api_token", variables.get("metal_api_token", os.environ.get("METALCTL_APITOKEN")))
+        # an explicit api_url takes precedence over the endpoints variable
+        endpoints = variables.get("metal_api_endpoints") if "api_url" not in kwargs else None
+        endpoints = kwargs.pop("endpoints", endpoints)
+
+        endpoint = dict(
+            url=kwargs.pop("api_url", variables.get("metal_api_url", os.environ.get("METALCTL_API_URL"))),
+            hmac=kwargs.pop("api_hmac", variables.get("metal_api_hmac", os.environ.get("METALCTL_HMAC"))),
+            hmac_user=kwargs.pop("api_hmac_user", variables.get("metal_api_hmac_user", "Metal-Edit")),
+            token=kwargs.pop("api_token", variables.get("metal_api_token", os.environ.get("METALCTL_APITOKEN"))),
+        )
+
+        endpoint_errors = kwargs.pop("endpoint_errors", "fail")
+        if endpoint_errors not in LookupModule._endpoint_errors:
+            raise AnsibleError("endpoint_errors must be one of %s" % LookupModule._endpoint_errors)
 
         entity = kwargs.pop("entity", terms[1] if len(terms) == 2 else None)
         if not entity:
@@ -234,6 +996,30 @@ class LookupModule(LookupBase):
         if request not in LookupModule._request_types:
             raise AnsibleError("request must be present and one of %s" % LookupModule._request_types)
 
+        pool_size = kwargs.pop("connection_pool_size", None)
+        opts = dict(
+            cache=boolean(kwargs.pop("cache", True), strict=False),
+            cache_ttl=int(kwargs.pop("cache_ttl", 60)),
+            cache_ttls=dict(LookupModule._cache_ttls, **kwargs.pop("cache_ttls", dict())),
+            cache_size=int(kwargs.pop("cache_size", 256)),
+            cache_dir=kwargs.pop("cache_dir", variables.get("metal_lookup_cache_dir",
+                                                            os.environ.get("METAL_LOOKUP_CACHE_DIR"))),
+            cache_max_bytes=int(kwargs.pop("cache_max_bytes", 64 * 1024 * 1024)),
+            cache_lock_timeout=int(kwargs.pop("cache_lock_timeout", 60)),
+            connection_pool_size=int(pool_size) if pool_size else None,
+            fields=kwargs.pop("fields", kwargs.pop("projection", None)),
+            raw=boolean(kwargs.pop("raw", False), strict=False),
+            join=kwargs.pop("join", None),
+            negative_cache_ttl=int(kwargs.pop("negative_cache_ttl", 10)),
+            max_workers=int(kwargs.pop("max_workers", 8)),
+            on_missing=kwargs.pop("on_missing", "fail"),
+        )
+        for o in ["fields", "join"]:
+            if isinstance(opts[o], str):
+                opts[o] = [v.strip() for v in opts[o].split(",")]
+        if opts["on_missing"] not in LookupModule._on_missing:
+            raise AnsibleError("on_missing must be one of %s" % LookupModule._on_missing)
+
         # some query parameters overlap with default Ansible lookup plugin input params
         # allow a user to use a query param by prepending an underscore
         query = dict()
@@ -243,14 +1029,266 @@ class LookupModule(LookupBase):
             else:
                 query[k] = v
 
-        d = Driver(url, token, hmac, hmac_user=hmac_user)
+        if endpoints:
+            return [self._lookup_endpoints(endpoints, endpoint, entity, request, query, opts, endpoint_errors)]
 
-        requester = LookupModule._entities[entity](client=d.client)
+        return [self._lookup(endpoint, entity, request, query, opts)]
+
+    def _lookup_endpoints(self, endpoints, defaults, entity, request, query, opts, endpoint_errors):
+        named = list()
+        for e in endpoints:
+            if not e.get("api_url"):
+                raise AnsibleError("api_url must be present for every endpoint")
+            named.append((e.get("name", e["api_url"]), dict(
+                url=e["api_url"],
+                hmac=e.get("api_hmac"),
+                hmac_user=e.get("api_hmac_user", defaults["hmac_user"]),
+                token=e.get("api_token"),
+            )))
+
+        def lookup(endpoint):
+            try:
+                return True, self._lookup(endpoint, entity, request, query, opts)
+            except rest.ApiException as e:
+                if request == "get" and e.status == 404 and opts["on_missing"] != "fail":
+                    return True, list()
+                return False, e
+            except Exception as e:
+                return False, e
+
+        with ThreadPoolExecutor(max_workers=len(named)) as executor:
+            results = list(executor.map(lookup, [endpoint for _, endpoint in named]))
+
+        merged = dict() if request == "exists" else list()
+        errors = list()
+        for (name, _), (ok, result) in zip(named, results):
+            if not ok:
+                errors.append((name, result))
+                continue
+
+            if request == "exists":
+                merged[name] = result
+                continue
+
+            for e in result if isinstance(result, list) else [result]:
+                if e is not None:
+                    e["endpoint"] = name
+                merged.append(e)
+
+        if errors and endpoint_errors == "fail":
+            raise AnsibleError("lookup failed for endpoints: %s"
+                               % "; ".join("%s: %s" % (name, error) for name, error in errors))
+        for name, error in errors:
+            display.warning("metal lookup against endpoint %s failed: %s" % (name, error))
+
+        return merged
+
+    def _lookup(self, endpoint, entity, request, query, opts):
+        if request == "exists":
+            return self._exists(endpoint, entity, query, opts)
+
+        if request == "latest":
+            return self._latest(endpoint, entity, query, opts)
+
+        if opts["join"]:
+            return self._join(endpoint, entity, request, query, opts)
+
+        if request == "get" and isinstance(query.get("id"), list):
+            return self._get_many(endpoint, entity, query, opts)
+
+        if request == "search" and query and LookupModule._entities[entity].client_side_search:
+            return self._search_client_side(endpoint, entity, query, opts)
+
+        return self._cached(endpoint, entity, request, query, opts)
+
+    def _join(self, endpoint, entity, request, query, opts):
+        relations = LookupModule._relations.get(entity, dict())
+        for relation in opts["join"]:
+            if relation not in relations:
+                raise AnsibleError("%s cannot be joined with %s, possible joins are: %s"
+                                   % (entity, relation, ", ".join(sorted(relations))))
+
+        # foreign keys must be read from the complete entities, the projection is applied after joining
+        full = dict(opts, fields=None, join=None)
+
+        def targets(relation):
+            target, _, _, scope = relations[relation]
+            target_query = {scope[k]: v for k, v in query.items() if k in scope}
+            return self._lookup(endpoint, target, "search", target_query, full)
+
+        with ThreadPoolExecutor(max_workers=len(opts["join"]) + 1) as executor:
+            primary = executor.submit(self._lookup, endpoint, entity, request, query, full)
+            joined = [(relation, executor.submit(targets, relation)) for relation in opts["join"]]
+
+            result = primary.result()
+            entities = result if isinstance(result, list) else [result]
+            entities = [e for e in entities if e is not None]
+            for relation, future in joined:
+                _, foreign_key, key, _ = relations[relation]
+                hash_join(entities, relation, future.result(), foreign_key, key)
+
+        if not opts["fields"]:
+            return result
+
+        tree = projection_tree(opts["fields"])
+        return project(result, tree)
+
+    def _latest(self, endpoint, entity, query, opts):
+        if entity != "image":
+            raise AnsibleError("latest is only supported for images")
+        if not query.get("os"):
+            raise AnsibleError("os must be present")
+
+        # the index is shared by all lookups within the ttl of the image list
+        full = dict(opts, fields=None)
+        key = ("image-index",) + self._cache_key(endpoint, entity, "search", dict(), full)
+
+        hit, index = _memo.get(key) if opts["cache"] else (False, None)
+        if not hit:
+            index = ImageIndex(self._cached(endpoint, entity, "search", dict(), full))
+            if opts["cache"]:
+                _memo.put(key, index, self._ttl(entity, opts))
+
+        try:
+            image = index.latest(query["os"], version=query.get("version"), feature=query.get("feature"))
+        except ValueError:
+            raise AnsibleError("version must consist of numbers separated by dots: %s" % query.get("version"))
+
+        if image is None:
+            if opts["on_missing"] == "fail":
+                raise AnsibleError("no usable image found for %s" % query)
+            return None
+
+        tree = projection_tree(opts["fields"]) if opts["fields"] else None
+        return project(copy.deepcopy(image), tree)
+
+    def _search_client_side(self, endpoint, entity, query, opts):
+        # the index is built from the complete, unprojected entities and shares their cache ttl
+        full = dict(opts, fields=None)
+        key = ("index",) + self._cache_key(endpoint, entity, "search", dict(), full)
+
+        hit, index = _memo.get(key) if opts["cache"] else (False, None)
+        if not hit:
+            index = EntityIndex(self._cached(endpoint, entity, "search", dict(), full))
+            if opts["cache"]:
+                _memo.put(key, index, self._ttl(entity, opts))
+
+        tree = projection_tree(opts["fields"]) if opts["fields"] else None
+        return [project(copy.deepcopy(e), tree) for e in index.search(**query)]
+
+    def _exists(self, endpoint, entity, query, opts):
+        def exists(id):
+            try:
+                self._cached(endpoint, entity, "get", dict(query, id=id), opts)
+                return True
+            except rest.ApiException as e:
+                if e.status != 404:
+                    raise AnsibleError("existence of %s %s could not be checked: %s" % (entity, id, e))
+                return False
+
+        ids = query.get("id")
+        if ids is None:
+            raise AnsibleError("id must be present")
+        if not isinstance(ids, list):
+            return exists(ids)
+        if not ids:
+            return list()
+
+        with ThreadPoolExecutor(max_workers=min(opts["max_workers"], len(ids))) as executor:
+            return list(executor.map(exists, ids))
+
+    def _get_many(self, endpoint, entity, query, opts):
+        ids = query["id"]
+        if not ids:
+            return list()
+
+        def get(id):
+            q = dict(query, id=id)
+            try:
+                return True, self._cached(endpoint, entity, "get", q, opts)
+            except rest.ApiException as e:
+                if e.status != 404 or opts["on_missing"] == "fail":
+                    raise AnsibleError("%s %s could not be fetched: %s" % (entity, id, e))
+                return opts["on_missing"] != "skip", None
+
+        with ThreadPoolExecutor(max_workers=min(opts["max_workers"], len(ids))) as executor:
+            results = list(executor.map(get, ids))
+
+        return [result for keep, result in results if keep]
+
+    def _fetch(self, endpoint, entity, request, query, opts):
+        requester = pooled_requester(entity, pool_size=opts["connection_pool_size"], **endpoint)
+        tree = projection_tree(opts["fields"]) if opts["fields"] else None
+
+        if opts["raw"]:
+            if request == "get":
+                return from_raw(requester.get(raw=True, **query), requester.model, tree)
+            return [from_raw(e, requester.model, tree) for e in requester.search(raw=True, **query)]
 
         if request == "get":
-            return [requester.get(**query).to_dict()]
+            return project(requester.get(**query), tree)
 
         result = list()
         for e in requester.search(**query):
-            result.append(e.to_dict())
-        return [result]
+            result.append(project(e, tree))
+        return result
+
+    @staticmethod
+    def _cache_key(endpoint, entity, request, query, opts):
+        credentials = credential_identity(endpoint["token"], endpoint["hmac"], endpoint["hmac_user"])
+        return cache_key(endpoint["url"], credentials, entity, request, query, fields=opts["fields"], raw=opts["raw"])
+
+    @staticmethod
+    def _ttl(entity, opts):
+        return int(opts["cache_ttls"].get(entity, opts["cache_ttl"]))
+
+    def _cached(self, endpoint, entity, request, query, opts):
+        negative_ttl = opts["negative_cache_ttl"]
+        positive_ttl = self._ttl(entity, opts)
+        if not opts["cache"] or (positive_ttl <= 0 and negative_ttl <= 0):
+            return self._fetch(endpoint, entity, request, query, opts)
+
+        def fetch():
+            try:
+                return self._fetch(endpoint, entity, request, query, opts)
+            except rest.ApiException as e:
+                if request == "get" and e.status == 404 and negative_ttl > 0:
+                    return MISSING
+                raise
+
+        def ttl(value):
+            return negative_ttl if value == MISSING else positive_ttl
+
+        _memo.maxsize = opts["cache_size"]
+        key = self._cache_key(endpoint, entity, request, query, opts)
+
+        hit, serialized = _memo.get(key)
+        if hit:
+            result = pickle.loads(serialized)
+        else:
+            disk = None
+            if opts["cache_dir"]:
+                disk = DiskCache(opts["cache_dir"], max_bytes=opts["cache_max_bytes"],
+                                 lock_timeout=opts["cache_lock_timeout"])
+
+            if disk is None:
+                result = fetch()
+            elif positive_ttl > 0:
+                result = disk.get_or_fetch(key, ttl, fetch)
+            else:
+                # results are not cached, so workers must not wait for each other's fetch,
+                # only a missing entity is shared
+                hit, result = disk.get(key)
+                if not hit or result != MISSING:
+                    result = fetch()
+                    if result == MISSING:
+                        disk.put(key, result, negative_ttl)
+            # the memo holds a serialized copy, such that callers cannot modify the memoized result and
+            # unpickling a hit is much cheaper than a deep copy
+            if ttl(result) > 0:
+                _memo.put(key, pickle.dumps(result, pickle.HIGHEST_PROTOCOL), ttl(result))
+
+        if result == MISSING:
+            raise rest.ApiException(status=404, reason="%s %s does not exist (cached)" % (entity, query.get("id")))
+
+        return result
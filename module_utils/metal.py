@@ -1,7 +1,11 @@
 import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 try:
     from metal_python.driver import Driver
+    from metal_python import models
 
     METAL_PYTHON_AVAILABLE = True
 except ImportError:
@@ -33,3 +37,110 @@ def init_driver_for_module(module):
 
 def init_driver(url, hmac, token, hmac_user):
     return Driver(url, token, hmac, hmac_user=hmac_user)
+
+
+def allocation_networks(networks):
+    """
+    returns the allocation networks for a list of network ids, which can carry the ip acquisition mode
+    as :auto or :noauto suffix. raises a ValueError for an unknown mode.
+    """
+    result = list()
+    for n in networks:
+        auto_acquire = True
+        network_id = n
+        if ":" in n:
+            network_id = n.split(":")[0]
+            mode = n.split(":")[-1]
+            if mode == "noauto":
+                auto_acquire = False
+            elif mode == "auto":
+                auto_acquire = True
+            else:
+                raise ValueError("network acquisition mode not supported: %s" % mode)
+
+        result.append(models.V1MachineAllocationNetwork(autoacquire=auto_acquire, networkid=network_id))
+    return result
+
+
+def attached_ips(machines):
+    """
+    returns the ip addresses of all networks of the given machines
+    """
+    result = set()
+    for machine in machines:
+        if not machine.allocation:
+            continue
+        for network in machine.allocation.networks or []:
+            result.update(network.ips or [])
+    return result
+
+
+def run_concurrently(fn, items, parallelism):
+    """
+    calls fn for every item with at most parallelism concurrent calls.
+    returns a list of (result, error) tuples in the order of the items, where error is the raised exception.
+    """
+    def call(item):
+        try:
+            return fn(item), None
+        except Exception as e:
+            return None, e
+
+    if not items:
+        return list()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallelism, len(items)))) as executor:
+        return list(executor.map(call, items))
+
+
+def backoff_delay(attempt, initial_delay, max_delay):
+    """
+    returns the delay before the next poll, growing exponentially with the attempt up to max_delay.
+    half of the delay is randomized such that many pollers do not hit the metal-api at the same time.
+    """
+    delay = min(max_delay, initial_delay * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def wait_until(check, timeout, initial_delay=1, max_delay=30):
+    """
+    calls check with exponential backoff until it returns True or the timeout in seconds is exceeded.
+    returns False on timeout.
+    """
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        if check():
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(remaining, backoff_delay(attempt, initial_delay, max_delay)))
+        attempt += 1
+
+
+def provisioning_events(machine):
+    """
+    returns the provisioning event log of a machine as a list of dicts, oldest event first.
+    """
+    events = getattr(machine.events, "log", None) or []
+    timeline = [dict(
+        time=e.time.isoformat() if hasattr(e.time, "isoformat") else e.time,
+        event=e.event,
+        message=e.message,
+    ) for e in events]
+    return sorted(timeline, key=lambda e: e["time"] or "")
+
+
+def provisioning_state(machine):
+    """
+    returns the provisioning state of an allocated machine as a tuple of state and reason,
+    where state is one of ready, failed or pending.
+    """
+    if getattr(machine.events, "crash_loop", False):
+        return "failed", "machine is in a provisioning crash loop"
+    if getattr(machine.events, "failed_machine_reclaim", False):
+        return "failed", "machine reclaim failed"
+    if machine.allocation and machine.allocation.succeeded:
+        return "ready", None
+    return "pending", None
@@ -3,8 +3,11 @@ import os
 import json
 import unittest
 
+from datetime import datetime, timezone
+
 from ansible.module_utils import basic
 from ansible.module_utils._text import to_bytes
+from metal_python import models
 
 from module_utils import metal
 
@@ -19,6 +22,75 @@ def set_module_args(args):
     basic._ANSIBLE_ARGS = to_bytes(args)
 
 
+def provisioning_events(*events, crash_loop=False):
+    """recent provisioning events of a machine, the last given event is the newest"""
+    return models.V1MachineRecentProvisioningEvents(
+        crash_loop=crash_loop,
+        failed_machine_reclaim=False,
+        last_event_time=None,
+        log=[models.V1MachineProvisioningEvent(event=e, message="",
+                                               time=datetime(2024, 1, 1, second=i, tzinfo=timezone.utc))
+             for i, e in reversed(list(enumerate(events)))],
+    )
+
+
+def machine_response(id, name=None, project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                     tags=("ci.metal-stack.io/manager=ansible",), allocated=True, succeeded=True, events=None,
+                     description=None, networks=(), rack=None, role="machine", firewall_rules=None,
+                     model=models.V1MachineResponse):
+    """a machine as returned by the metal-api, networks are tuples of network id and ips of the allocation"""
+    allocation = None
+    if allocated:
+        allocation = models.V1MachineAllocation(
+            allocationuuid="d87250e5-ff2f-49fd-a8fe-9eee23085511",
+            created=datetime(2024, 1, 1, tzinfo=timezone.utc),
+            creator="",
+            description=description,
+            hostname=name or id,
+            name=name or id,
+            project=project,
+            reinstall=False,
+            role=role,
+            ssh_pub_keys=[],
+            succeeded=succeeded,
+            firewall_rules=firewall_rules,
+            networks=[
+                models.V1MachineNetwork(
+                    asn=0,
+                    destinationprefixes=[],
+                    ips=ips,
+                    nat=network_id == "internet",
+                    underlay=False,
+                    private=network_id != "internet",
+                    networkid=network_id,
+                    networktype="external" if network_id == "internet" else "privateprimaryunshared",
+                    prefixes=[],
+                    vrf=0,
+                ) for network_id, ips in networks
+            ],
+        )
+
+    return model(
+        id=id,
+        bios=models.V1MachineBIOS(_date="", vendor="", version=""),
+        events=events if events else provisioning_events(),
+        hardware=models.V1MachineHardware(cpu_cores=4, disks=[], memory=1024, nics=[]),
+        ledstate=models.V1ChassisIdentifyLEDState(description="", value=""),
+        liveliness="Alive",
+        rackid=rack,
+        state=models.V1MachineState(description="", issuer="", metal_hammer_version="", value=""),
+        tags=list(tags),
+        allocation=allocation,
+    )
+
+
+def firewall_response(id, name, project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                      tags=("ci.metal-stack.io/manager=ansible",), firewall_rules=None):
+    """a firewall as returned by the metal-api"""
+    return machine_response(id, name, project, tags=tags, role="firewall", firewall_rules=firewall_rules,
+                            model=models.V1FirewallResponse)
+
+
 class AnsibleExitJson(Exception):
     """Exception class to be raised by module.exit_json and caught by the test case"""
 
@@ -5,6 +5,7 @@ from test import (
     AnsibleFailJson,
     AnsibleExitJson,
     set_module_args,
+    firewall_response,
     MODULES_PATH,
 )
 from metal_python import models
@@ -384,3 +385,238 @@ class TestMetalFirewallModule(MetalModules):
             changed=True,
         )
         self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls",
+           side_effect=[[firewall_response("1", "cluster-a")]])
+    @patch("metal_python.api.firewall_api.FirewallApi.allocate_firewall",
+           side_effect=lambda r: firewall_response("id-" + r.name, r.name))
+    def test_firewall_bulk(self, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+                networks=["internet"],
+                firewalls=[
+                    dict(name="cluster-a"),
+                    dict(name="cluster-b", rules=dict(egress=[dict(ports=[443], to=["0.0.0.0/0"])])),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1FirewallFindRequest(
+            allocation_project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+        allocate_mock.assert_called_once_with(models.V1FirewallCreateRequest(
+            name="cluster-b",
+            hostname="cluster-b",
+            projectid="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+            imageid="ubuntu",
+            partitionid="partition-id",
+            sizeid="c1",
+            networks=[models.V1MachineAllocationNetwork(autoacquire=True, networkid="internet")],
+            ips=[],
+            ssh_pub_keys=[],
+            firewall_rules=models.V1FirewallRules(
+                egress=[models.V1FirewallEgressRule(ports=[443], to=["0.0.0.0/0"])],
+                ingress=[],
+            ),
+            tags=["ci.metal-stack.io/manager=ansible"],
+        ))
+
+        expected = dict(
+            changed=True,
+            firewalls=[
+                dict(name="cluster-a", state="present", id="1", changed=False),
+                dict(name="cluster-b", state="present", id="id-cluster-b", changed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls",
+           side_effect=[[firewall_response("1", "cluster-a"), firewall_response("2", "cluster-a")]])
+    def test_firewall_bulk_ambiguous_name(self, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                firewalls=[dict(name="cluster-a")],
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "not all firewalls could be managed")
+        self.assertFalse(results["changed"])
+        self.assertIn("multiple firewalls of name 'cluster-a'", results["firewalls"][0]["msg"])
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls",
+           side_effect=[[firewall_response("1", "test", firewall_rules=models.V1FirewallRules(
+               egress=[models.V1FirewallEgressRule(comment="dns", ports=[53], protocol="udp", to=["0.0.0.0/0"])],
+               ingress=[models.V1FirewallIngressRule(comment="ssh", ports=[22], protocol="tcp",
+                                                     _from=["10.0.0.0/8", "192.168.0.0/16"], to=[])],
+           ))]])
+    def test_firewall_rules_unchanged(self, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                rules_drift="fail",
+                rules=dict(
+                    ingress=[dict(ports=[22], source=["192.168.0.0/16", "10.0.0.0/8"])],
+                    egress=[dict(comment="resolve", ports=[53], protocol="udp", to=["0.0.0.0/0"])],
+                ),
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        self.assertDictEqual(result.exception.module_results, dict(id="1", changed=False))
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls",
+           side_effect=[[firewall_response("1", "test", firewall_rules=models.V1FirewallRules(
+               egress=[models.V1FirewallEgressRule(ports=[443], protocol="tcp", to=["0.0.0.0/0"])],
+               ingress=[],
+           ))]])
+    def test_firewall_rules_drift_fail(self, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                rules_drift="fail",
+                rules=dict(
+                    ingress=[dict(ports=[22], source=["10.0.0.0/8"])],
+                    egress=[dict(ports=[80, 443], to=["0.0.0.0/0"])],
+                ),
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "rules of firewall 1 differ from the deployed rules, they only apply on "
+                                         "allocation")
+        self.assertDictEqual(results["rules_diff"], dict(
+            ingress=dict(
+                added=[dict(protocol="tcp", ports=[22], source=["10.0.0.0/8"], to=[])],
+                removed=[],
+            ),
+            egress=dict(
+                added=[dict(protocol="tcp", ports=[80, 443], to=["0.0.0.0/0"])],
+                removed=[dict(protocol="tcp", ports=[443], to=["0.0.0.0/0"])],
+            ),
+        ))
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls",
+           side_effect=[[firewall_response("1", "test", firewall_rules=models.V1FirewallRules(egress=[], ingress=[]))]])
+    def test_firewall_rules_drift_warn(self, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                rules=dict(egress=[dict(ports=[443], to=["0.0.0.0/0"])]),
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        results = result.exception.module_results
+        self.assertFalse(results["changed"])
+        self.assertEqual(results["rules_diff"]["egress"]["added"], [dict(protocol="tcp", ports=[443],
+                                                                         to=["0.0.0.0/0"])])
+
+    def test_normalize_rules(self):
+        rules = self.module.firewall_rules(dict(
+            ingress=[
+                dict(comment="ssh office", ports=[22], source=["10.0.0.0/25"]),
+                dict(comment="ssh vpn", ports=[22], source=["10.0.0.128/25", "10.0.0.1/32"]),
+                dict(comment="http", ports=[80], source=["10.0.0.0/24"]),
+                dict(comment="https", ports=[443, 80], source=["10.0.0.0/24"]),
+                dict(ports=[53], protocol="udp", source=["2001:db8::/33", "2001:db8:8000::/33"]),
+            ],
+            egress=[
+                dict(comment="web", ports=[443], to=["0.0.0.0/0"]),
+                dict(comment="web again", ports=[443], to=["0.0.0.0/0"]),
+                dict(ports=[80], protocol="tcp", to=["0.0.0.0/0"]),
+            ],
+        ))
+
+        normalized, reduction = self.module.normalize_rules(rules)
+
+        self.assertEqual(normalized.ingress, [
+            models.V1FirewallIngressRule(comment="ssh office", ports=[22, 80, 443], protocol="tcp",
+                                         _from=["10.0.0.0/24"], to=[]),
+            models.V1FirewallIngressRule(ports=[53], protocol="udp", _from=["2001:db8::/32"], to=[]),
+        ])
+        self.assertEqual(normalized.egress, [
+            models.V1FirewallEgressRule(comment="web", ports=[80, 443], protocol="tcp", to=["0.0.0.0/0"]),
+        ])
+        self.assertDictEqual(reduction, dict(
+            ingress=dict(before=5, after=2),
+            egress=dict(before=3, after=1),
+        ))
+
+    @patch("metal_python.api.firewall_api.FirewallApi.find_firewalls", side_effect=[[]])
+    @patch("metal_python.api.firewall_api.FirewallApi.allocate_firewall",
+           side_effect=lambda r: firewall_response("1", r.name))
+    def test_firewall_allocate_normalized_rules(self, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+                normalize_rules=True,
+                rules=dict(egress=[
+                    dict(ports=[443], to=["10.0.0.0/24"]),
+                    dict(ports=[443], to=["10.0.1.0/24"]),
+                ]),
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        self.assertEqual(allocate_mock.call_args[0][0].firewall_rules, models.V1FirewallRules(
+            ingress=[],
+            egress=[models.V1FirewallEgressRule(ports=[443], protocol="tcp", to=["10.0.0.0/23"])],
+        ))
+        self.assertDictEqual(result.exception.module_results["rules_reduction"], dict(
+            ingress=dict(before=0, after=0),
+            egress=dict(before=2, after=1),
+        ))
+
+    def test_firewall_bulk_exclusive_with_single_firewall(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                name="cluster-a",
+                firewalls=[dict(name="cluster-a")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "parameters are mutually exclusive: firewalls\\|name"):
+            self.module.main()
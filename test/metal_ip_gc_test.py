@@ -0,0 +1,127 @@
+import sys
+from mock import patch
+from test import (
+    MetalModules,
+    AnsibleFailJson,
+    AnsibleExitJson,
+    set_module_args,
+    machine_response,
+    MODULES_PATH,
+)
+from metal_python import models, rest
+
+sys.path.insert(0, MODULES_PATH)
+
+
+def ip(address, name="", project="p1", tags=("ci.metal-stack.io/manager=ansible",)):
+    return models.V1IPResponse(
+        type="ephemeral",
+        ipaddress=address,
+        name=name,
+        allocationuuid="a-unique-id",
+        networkid="internet",
+        projectid=project,
+        tags=list(tags),
+    )
+
+
+PROJECT_IPS = [
+    ip("212.34.83.1", name="worker-1"),
+    ip("212.34.83.2", name="worker-2"),
+    ip("212.34.83.3", name="other", tags=["ci.metal-stack.io/manager=ansible", "cluster=test-a"]),
+    ip("212.34.83.4", name="unmanaged", tags=[]),
+    ip("212.34.83.5", name="service", tags=["ci.metal-stack.io/manager=ansible",
+                                            "cluster.metal-stack.io/id/namespace/service=c/default/lb"]),
+]
+
+
+class TestMetalIPGCModule(MetalModules):
+    def setUp(self):
+        self.defaultSetUpTasks()
+
+        import metal_ip_gc
+        self.module = metal_ip_gc
+
+    def test_module_fail_when_required_args_missing(self):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+        ))
+        with self.assertRaisesRegex(AnsibleFailJson, "missing required arguments: projects"):
+            self.module.main()
+
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps", side_effect=[PROJECT_IPS])
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("m1", networks=[("internet", ["212.34.83.1"])])]])
+    @patch("metal_python.api.ip_api.IpApi.free_ip", side_effect=lambda address: ip(address))
+    def test_ip_gc(self, free_mock, find_machines_mock, find_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            projects=["p1"],
+        ))
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1IPFindRequest(projectid="p1", type="ephemeral"))
+        find_machines_mock.assert_called_once_with(models.V1MachineFindRequest(allocation_project="p1"))
+        self.assertEqual(sorted(c[0][0] for c in free_mock.call_args_list), ["212.34.83.2", "212.34.83.3"])
+
+        expected = dict(
+            changed=True,
+            ips=[
+                dict(ipaddress="212.34.83.2", name="worker-2", project="p1", freed=True),
+                dict(ipaddress="212.34.83.3", name="other", project="p1", freed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps", side_effect=[PROJECT_IPS])
+    @patch("metal_python.api.machine_api.MachineApi.find_machines", side_effect=[[]])
+    @patch("metal_python.api.ip_api.IpApi.free_ip")
+    def test_ip_gc_dry_run_with_pattern(self, free_mock, find_machines_mock, find_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            projects=["p1"],
+            type="all",
+            name_pattern="worker-*",
+            dry_run=True,
+        ))
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1IPFindRequest(projectid="p1"))
+        free_mock.assert_not_called()
+
+        expected = dict(
+            changed=False,
+            ips=[
+                dict(ipaddress="212.34.83.1", name="worker-1", project="p1", freed=False),
+                dict(ipaddress="212.34.83.2", name="worker-2", project="p1", freed=False),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps", side_effect=[PROJECT_IPS])
+    @patch("metal_python.api.machine_api.MachineApi.find_machines", side_effect=[[]])
+    @patch("metal_python.api.ip_api.IpApi.free_ip", side_effect=rest.ApiException(status=500, reason="error"))
+    def test_ip_gc_free_fails(self, free_mock, find_machines_mock, find_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            projects=["p1"],
+            tag_pattern="cluster=test-*",
+        ))
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        free_mock.assert_called_once_with("212.34.83.3")
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "not all orphaned ips could be freed")
+        self.assertFalse(results["changed"])
+        self.assertTrue(results["ips"][0]["failed"])
@@ -7,7 +7,7 @@ from test import (
     set_module_args,
     MODULES_PATH,
 )
-from metal_python import models
+from metal_python import models, rest
 
 sys.path.insert(0, MODULES_PATH)
 
@@ -312,3 +312,177 @@ class TestMetalIPModule(MetalModules):
 
         with self.assertRaisesRegex(AnsibleFailJson, "either ip or name must be given"):
             self.module.main()
+
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps",
+           side_effect=[
+               [
+                   models.V1IPResponse(
+                       ipaddress="212.34.89.1",
+                       allocationuuid="a-unique-id-1",
+                       name="unchanged",
+                       description="a",
+                       networkid="internet",
+                       projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                       type="static",
+                       tags=["ci.metal-stack.io/manager=ansible"]),
+                   models.V1IPResponse(
+                       ipaddress="212.34.89.2",
+                       allocationuuid="a-unique-id-2",
+                       name="updated",
+                       description="a",
+                       networkid="internet",
+                       projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                       type="static",
+                       tags=["ci.metal-stack.io/manager=ansible"]),
+                   models.V1IPResponse(
+                       ipaddress="212.34.89.3",
+                       allocationuuid="a-unique-id-3",
+                       name="freed",
+                       networkid="internet",
+                       projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                       type="static",
+                       tags=["ci.metal-stack.io/manager=ansible"]),
+               ],
+           ])
+    @patch("metal_python.api.ip_api.IpApi.allocate_ip",
+           side_effect=[
+               models.V1IPResponse(
+                   ipaddress="212.34.89.4",
+                   allocationuuid="a-unique-id-4",
+                   name="allocated",
+                   networkid="internet",
+                   projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                   type="static",
+                   tags=["ci.metal-stack.io/manager=ansible"]),
+           ])
+    @patch("metal_python.api.ip_api.IpApi.update_ip",
+           side_effect=[
+               models.V1IPResponse(
+                   ipaddress="212.34.89.2",
+                   allocationuuid="a-unique-id-2",
+                   name="updated",
+                   description="b",
+                   networkid="internet",
+                   projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                   type="static",
+                   tags=["ci.metal-stack.io/manager=ansible"]),
+           ])
+    @patch("metal_python.api.ip_api.IpApi.free_ip")
+    def test_ip_bulk(self, free_mock, update_mock, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="2ada3f21-67fc-4432-a9ba-89b670245456",
+                network="internet",
+                type="static",
+                ips=[
+                    dict(name="unchanged", description="a"),
+                    dict(name="updated", description="b"),
+                    dict(name="allocated"),
+                    dict(name="freed", state="absent"),
+                    dict(name="already-freed", state="absent"),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1IPFindRequest(
+            projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+        ))
+        allocate_mock.assert_called_once_with(
+            models.V1IPAllocateRequest(
+                name="allocated",
+                networkid="internet",
+                projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                tags=["ci.metal-stack.io/manager=ansible"],
+                type="static",
+            )
+        )
+        update_mock.assert_called_once_with(
+            models.V1IPUpdateRequest(
+                ipaddress="212.34.89.2",
+                description="b",
+                type="static",
+            )
+        )
+        free_mock.assert_called_once_with("212.34.89.3")
+
+        expected = dict(
+            changed=True,
+            ips=[
+                dict(name="unchanged", state="present", ip="212.34.89.1", changed=False),
+                dict(name="updated", state="present", ip="212.34.89.2", changed=True),
+                dict(name="allocated", state="present", ip="212.34.89.4", changed=True),
+                dict(name="freed", state="absent", ip="212.34.89.3", changed=True),
+                dict(name="already-freed", state="absent", ip=None, changed=False),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps",
+           side_effect=[
+               [
+                   models.V1IPResponse(
+                       ipaddress="212.34.89.1",
+                       allocationuuid="a-unique-id-1",
+                       name="unmanaged",
+                       networkid="internet",
+                       projectid="2ada3f21-67fc-4432-a9ba-89b670245456",
+                       type="static",
+                       tags=[]),
+               ],
+           ])
+    @patch("metal_python.api.ip_api.IpApi.allocate_ip",
+           side_effect=rest.ApiException(status=409, reason="Conflict"))
+    def test_ip_bulk_partial_failure(self, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="2ada3f21-67fc-4432-a9ba-89b670245456",
+                network="internet",
+                ips=[
+                    dict(name="unmanaged", state="absent"),
+                    dict(name="allocated"),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "not all ips could be managed")
+        self.assertTrue(results["ips"][0]["failed"])
+        self.assertIn("entity does not have label attached", results["ips"][0]["msg"])
+        self.assertTrue(results["ips"][1]["failed"])
+        self.assertIn("Conflict", results["ips"][1]["msg"])
+
+    def test_ip_bulk_project_required(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                ips=[dict(name="a")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "project is required when managing a list of ips"):
+            self.module.main()
+
+    def test_ip_bulk_exclusive_with_single_ip(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                name="a",
+                ips=[dict(name="a")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "parameters are mutually exclusive: ips\\|name"):
+            self.module.main()
@@ -0,0 +1,207 @@
+"""
+Benchmarks of the metal lookup plugin against canned metal-api responses.
+
+The http layer of metal-python is replaced by generated responses of every entity of the lookup, such that
+driver construction, model deserialization, to_dict() conversion and the complete lookup can be measured
+without an API. The benchmarks are not part of the test suite, run them from the repository root with:
+
+    python -m test.metal_lookup_benchmark --sizes 1,10,100,1000 --iterations 10 --json results.json
+
+Passing the results of a previous run with --baseline fails if a lookup got slower than --threshold.
+"""
+import argparse
+import ast
+import inspect
+import json
+import re
+import statistics
+import sys
+import time
+import tracemalloc
+
+from mock import patch
+from metal_python import models
+from metal_python.api_client import ApiClient
+from metal_python.driver import Driver
+
+from lookup_plugins import metal
+
+VARIABLES = dict(
+    metal_api_url="http://benchmark",
+    metal_api_hmac="hmac",
+)
+
+
+def _allowed_value(model, attr):
+    # some string fields are validated against an enum, which is only available in the setter source
+    try:
+        source = inspect.getsource(getattr(model, attr).fset)
+    except (AttributeError, TypeError, OSError):
+        return None
+    m = re.search(r"allowed_values = (\[.*?\])", source)
+    if not m:
+        return None
+    values = [v for v in ast.literal_eval(m.group(1)) if v]
+    return values[0] if values else ""
+
+
+def generate(type_name, depth=0):
+    """
+    generates the json of a swagger type with every field filled, lists have a few elements
+    """
+    if type_name.startswith("list["):
+        if depth > 6:
+            return list()
+        return [generate(type_name[5:-1], depth + 1) for _ in range(3 if depth < 3 else 1)]
+    if type_name.startswith("dict("):
+        return {"key": generate(type_name[5:-1].split(", ", 1)[1], depth + 1)}
+    if type_name == "str":
+        return "value"
+    if type_name in ("int", "float"):
+        return 1
+    if type_name == "bool":
+        return False
+    if type_name == "datetime":
+        return "2024-01-01T00:00:00Z"
+    if type_name == "date":
+        return "2024-01-01"
+    if type_name == "object":
+        return dict()
+
+    model = getattr(models, type_name)
+    result = dict()
+    for attr, t in model.swagger_types.items():
+        value = _allowed_value(model, attr) if t == "str" else None
+        result[model.attribute_map[attr]] = value if value is not None else generate(t, depth + 1)
+    return result
+
+
+def canned_entities(entity, size):
+    template = generate(metal.LookupModule._entities[entity].model)
+    entities = list()
+    for i in range(size):
+        e = json.loads(json.dumps(template))
+        if "id" in e:
+            e["id"] = "%s-%d" % (entity, i)
+        entities.append(e)
+    return entities
+
+
+class CannedResponse(object):
+    def __init__(self, body):
+        self.data = body
+        self.status = 200
+        self.reason = "OK"
+
+    def getheaders(self):
+        return dict()
+
+    def release_conn(self):
+        pass
+
+
+def measure(fn, iterations):
+    latencies = list()
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies.sort()
+    return dict(
+        mean_ms=statistics.mean(latencies) * 1000,
+        p95_ms=latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000,
+        peak_kib=peak / 1024,
+    )
+
+
+def run(sizes=(1, 10, 100), iterations=10, entities=None):
+    results = dict()
+
+    results["driver"] = measure(lambda: Driver("http://benchmark", None, "hmac"), iterations)
+
+    client = ApiClient()
+    lookup = metal.LookupModule()
+
+    for entity in entities or sorted(metal.LookupModule._entities):
+        model = metal.LookupModule._entities[entity].model
+
+        for size in sizes:
+            body = json.dumps(canned_entities(entity, size))
+            response = CannedResponse(body)
+            deserialized = client.deserialize(response, "list[%s]" % model)
+
+            scenarios = dict(
+                deserialize=lambda: client.deserialize(response, "list[%s]" % model),
+                to_dict=lambda: [e.to_dict() for e in deserialized],
+                lookup=lambda: lookup.run(["search", entity], variables=VARIABLES, cache=False),
+                lookup_raw=lambda: lookup.run(["search", entity], variables=VARIABLES, cache=False, raw=True),
+                lookup_cached=lambda: lookup.run(["search", entity], variables=VARIABLES,
+                                                 cache_ttls={entity: 60}),
+            )
+
+            with patch("metal_python.rest.RESTClientObject.request", return_value=CannedResponse(body)):
+                for name, fn in scenarios.items():
+                    r = measure(fn, iterations)
+                    r["entities_per_s"] = size / (r["mean_ms"] / 1000) if r["mean_ms"] else 0
+                    results["%s/%s/%d" % (entity, name, size)] = r
+
+            metal._memo.clear()
+
+    return results
+
+
+def regressions(results, baseline, threshold):
+    found = list()
+    for key, r in sorted(results.items()):
+        if key in baseline and r["mean_ms"] > baseline[key]["mean_ms"] * threshold:
+            found.append((key, baseline[key]["mean_ms"], r["mean_ms"]))
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="benchmarks the metal lookup plugin against canned responses")
+    parser.add_argument("--sizes", default="1,10,100,1000", help="comma-separated numbers of entities per response")
+    parser.add_argument("--iterations", type=int, default=10, help="lookups per scenario")
+    parser.add_argument("--entities", help="comma-separated entities, defaults to all entities of the lookup")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--baseline", help="results of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25, help="allowed slowdown factor against the baseline")
+    args = parser.parse_args(argv)
+
+    results = run(
+        sizes=[int(s) for s in args.sizes.split(",")],
+        iterations=args.iterations,
+        entities=args.entities.split(",") if args.entities else None,
+    )
+
+    print("%-40s %12s %12s %12s %16s" % ("scenario", "mean ms", "p95 ms", "peak KiB", "entities/s"))
+    for key, r in sorted(results.items()):
+        print("%-40s %12.3f %12.3f %12.1f %16.0f" % (key, r["mean_ms"], r["p95_ms"], r["peak_kib"],
+                                                     r.get("entities_per_s", 0)))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.threshold)
+        for key, before, after in found:
+            print("regression in %s: %.3f ms -> %.3f ms" % (key, before, after))
+        if found:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
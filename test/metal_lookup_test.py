@@ -0,0 +1,573 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from datetime import datetime, timedelta
+from mock import patch
+from metal_python import models
+
+from metal_python import rest
+from metal_python.api_client import ApiClient
+
+from ansible.errors import AnsibleError
+from lookup_plugins import metal
+from test import machine_response
+
+VARIABLES = dict(
+    metal_api_url="http://somewhere",
+    metal_api_hmac="hmac",
+)
+
+
+def image(id, features=None, expiration_date=None):
+    return models.V1ImageResponse(
+        id=id,
+        features=features if features else ["machine"],
+        expiration_date=expiration_date if expiration_date else datetime.now() + timedelta(days=30),
+        usedby=[],
+    )
+
+
+def network(id, name, prefixes, project=None, partition=None):
+    return models.V1NetworkResponse(
+        id=id,
+        name=name,
+        prefixes=prefixes,
+        projectid=project,
+        partitionid=partition,
+        destinationprefixes=[],
+        nat=False,
+        privatesuper=False,
+        underlay=False,
+        shared=False,
+        labels={},
+        consumption=models.V1NetworkConsumption(),
+        usage=models.V1NetworkUsage(available_ips=10, available_prefixes=1, used_ips=1, used_prefixes=1),
+    )
+
+
+class RawResponse(object):
+    def __init__(self, body, status=200):
+        self.data = json.dumps(ApiClient().sanitize_for_serialization(body)).encode("utf-8")
+        self.status = status
+        self.reason = "OK"
+
+    def getheaders(self):
+        return dict()
+
+    def release_conn(self):
+        pass
+
+
+def without_datetimes(value):
+    if isinstance(value, dict):
+        return {k: without_datetimes(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [without_datetimes(v) for v in value]
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+class TestMetalLookup(unittest.TestCase):
+    def setUp(self):
+        metal._memo.clear()
+        metal._drivers.clear()
+        metal._requesters.clear()
+        self.lookup = metal.LookupModule()
+
+    @patch("metal_python.api.image_api.ImageApi.find_image",
+           side_effect=[
+               image("ubuntu-24.04"),
+           ])
+    def test_get_is_memoized(self, mock):
+        first = self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+        second = self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+
+        mock.assert_called_once_with(id="ubuntu-24.04")
+        self.assertEqual(first, second)
+        self.assertEqual(first[0]["id"], "ubuntu-24.04")
+
+    @patch("metal_python.api.image_api.ImageApi.find_image",
+           side_effect=[
+               image("ubuntu-24.04"),
+               image("ubuntu-24.04"),
+           ])
+    def test_get_without_cache(self, mock):
+        self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04", cache=False)
+        self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04", cache=False)
+
+        self.assertEqual(mock.call_count, 2)
+
+    @patch("metal_python.api.image_api.ImageApi.find_image",
+           side_effect=[
+               image("ubuntu-24.04"),
+               image("debian-12"),
+           ])
+    def test_cache_key_contains_query_and_credentials(self, mock):
+        self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+        self.lookup.run(["get", "image"], variables=VARIABLES, id="debian-12")
+        self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+
+        self.assertEqual(mock.call_count, 2)
+
+    def test_machines_are_not_memoized_by_default(self):
+        with patch("metal_python.api.machine_api.MachineApi.find_machine",
+                   side_effect=lambda id: machine_response(id, "worker-1", "p1")) as mock:
+            for _ in range(2):
+                self.lookup.run(["get", "machine"], variables=VARIABLES, id="m1")
+            self.assertEqual(mock.call_count, 2)
+
+            for _ in range(2):
+                self.lookup.run(["get", "machine"], variables=VARIABLES, id="m1", cache_ttls=dict(machine=60))
+            self.assertEqual(mock.call_count, 3)
+
+    def test_memoized_result_is_not_modifiable(self):
+        with patch("metal_python.api.image_api.ImageApi.find_image",
+                   return_value=image("ubuntu-24.04")):
+            first = self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+            first[0]["features"].append("firewall")
+            second = self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+            second[0]["features"].append("firewall")
+            third = self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04")
+
+        self.assertEqual(second[0]["features"], ["machine", "firewall"])
+        self.assertEqual(third[0]["features"], ["machine"])
+
+    def test_get_many_keeps_order(self):
+        def find_image(id):
+            # make later requests finish first
+            time.sleep(0.01 * (3 - int(id[-1])))
+            return image(id)
+
+        with patch("metal_python.api.image_api.ImageApi.find_image", side_effect=find_image) as mock:
+            result = self.lookup.run(["get", "image"], variables=VARIABLES, id=["image-1", "image-2", "image-3"])
+
+        self.assertEqual(mock.call_count, 3)
+        self.assertEqual([i["id"] for i in result[0]], ["image-1", "image-2", "image-3"])
+
+    def test_get_many_on_missing(self):
+        def find_image(id):
+            if id == "missing":
+                raise rest.ApiException(status=404, reason="Not Found")
+            return image(id)
+
+        with patch("metal_python.api.image_api.ImageApi.find_image", side_effect=find_image):
+            with self.assertRaisesRegex(AnsibleError, "image missing could not be fetched"):
+                self.lookup.run(["get", "image"], variables=VARIABLES, id=["image-1", "missing"])
+
+            result = self.lookup.run(["get", "image"], variables=VARIABLES, id=["image-1", "missing", "image-2"],
+                                     on_missing="skip")
+            self.assertEqual([i["id"] for i in result[0]], ["image-1", "image-2"])
+
+            result = self.lookup.run(["get", "image"], variables=VARIABLES, id=["image-1", "missing"],
+                                     on_missing="none")
+            self.assertEqual(result[0][0]["id"], "image-1")
+            self.assertIsNone(result[0][1])
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[
+               machine_response("m1", "worker-1", "p1", networks=[("n1", ["10.0.0.1"]), ("internet", ["212.34.89.1"])]),
+               machine_response("m2", "worker-2", "p1", networks=[("n1", ["10.0.0.2"])]),
+           ]])
+    def test_search_with_fields(self, mock):
+        result = self.lookup.run(["search", "machine"], variables=VARIABLES, allocation_project="p1",
+                                 fields=["id", "allocation.name", "allocation.networks.networkid"])
+
+        self.assertEqual(result[0], [
+            dict(id="m1", allocation=dict(name="worker-1", networks=[dict(networkid="n1"),
+                                                                     dict(networkid="internet")])),
+            dict(id="m2", allocation=dict(name="worker-2", networks=[dict(networkid="n1")])),
+        ])
+
+    def test_projection_tree(self):
+        self.assertEqual(metal.projection_tree(["a.b", "a", "c.d", "c.e.f"]),
+                         dict(a=None, c=dict(d=None, e=dict(f=None))))
+
+    def test_projection_of_unknown_field(self):
+        with self.assertRaisesRegex(AnsibleError, "V1MachineResponse has no field allocation_name"):
+            metal.project(machine_response("m1", "worker-1", "p1"), metal.projection_tree(["allocation_name"]))
+
+    @patch("metal_python.api.partition_api.PartitionApi.list_partitions",
+           side_effect=[[
+               models.V1PartitionResponse(id="fra-equ01", bootconfig=models.V1PartitionBootConfiguration(),
+                                          labels={"region": "fra", "tier": "prod"}),
+               models.V1PartitionResponse(id="fra-equ02", bootconfig=models.V1PartitionBootConfiguration(),
+                                          labels={"region": "fra", "tier": "test"}),
+               models.V1PartitionResponse(id="muc-equ01", bootconfig=models.V1PartitionBootConfiguration(),
+                                          labels={"region": "muc", "tier": "prod"}),
+           ]])
+    def test_client_side_search(self, mock):
+        result = self.lookup.run(["search", "partition"], variables=VARIABLES, labels={"tier": "prod"})
+        self.assertEqual([p["id"] for p in result[0]], ["fra-equ01", "muc-equ01"])
+
+        result = self.lookup.run(["search", "partition"], variables=VARIABLES, labels={"tier": "prod", "region": "fra"})
+        self.assertEqual([p["id"] for p in result[0]], ["fra-equ01"])
+
+        result = self.lookup.run(["search", "partition"], variables=VARIABLES, _id="fra-equ02", fields=["id"])
+        self.assertEqual(result[0], [dict(id="fra-equ02")])
+
+        result = self.lookup.run(["search", "partition"], variables=VARIABLES, labels={"tier": "staging"})
+        self.assertEqual(result[0], [])
+
+        with self.assertRaisesRegex(AnsibleError, "unknown search field region"):
+            self.lookup.run(["search", "partition"], variables=VARIABLES, region="fra")
+
+        mock.assert_called_once()
+
+    def test_entity_index(self):
+        index = metal.EntityIndex([
+            dict(id="s1", partition=dict(id="fra-equ01"), rack_id="r1", features=["a", "b"]),
+            dict(id="s2", partition=dict(id="fra-equ01"), rack_id="r2", features=["b"]),
+            dict(id="s3", partition=dict(id="muc-equ01"), rack_id="r1", features=["a"]),
+        ])
+
+        self.assertEqual([e["id"] for e in index.search(partition="fra-equ01")], ["s1", "s2"])
+        self.assertEqual([e["id"] for e in index.search(partition="fra-equ01", rack_id="r1")], ["s1"])
+        self.assertEqual([e["id"] for e in index.search(features="a")], ["s1", "s3"])
+        self.assertEqual([e["id"] for e in index.search(features=["a", "b"])], ["s1"])
+        self.assertEqual([e["id"] for e in index.search()], ["s1", "s2", "s3"])
+        self.assertEqual([e["id"] for e in index.search(features=[])], ["s1", "s2", "s3"])
+        self.assertEqual([e["id"] for e in index.search(features=[], rack_id="r2")], ["s2"])
+
+    def test_raw_search_is_compatible_with_to_dict(self):
+        machines = [
+            machine_response("m1", "worker-1", "p1", networks=[("n1", ["10.0.0.1"]), ("internet", ["212.34.89.1"])]),
+            machine_response("m2", "worker-2", "p1", networks=[("n1", ["10.0.0.2"])]),
+        ]
+
+        with patch("metal_python.rest.RESTClientObject.request", return_value=RawResponse(machines)) as mock:
+            result = self.lookup.run(["search", "machine"], variables=VARIABLES, allocation_project="p1", raw=True)
+
+        self.assertFalse(mock.call_args.kwargs["_preload_content"])
+        self.assertEqual(result[0], [without_datetimes(m.to_dict()) for m in machines])
+
+    def test_raw_get_with_fields(self):
+        m = machine_response("m1", "worker-1", "p1", networks=[("n1", ["10.0.0.1"])])
+
+        with patch("metal_python.rest.RESTClientObject.request", return_value=RawResponse(m)):
+            result = self.lookup.run(["get", "machine"], variables=VARIABLES, id="m1", raw=True,
+                                     fields=["id", "allocation.networks.ips", "bios"])
+
+        self.assertEqual(result[0], dict(
+            id="m1",
+            allocation=dict(networks=[dict(ips=["10.0.0.1"])]),
+            bios=dict(_date="", vendor="", version=""),
+        ))
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[
+               machine_response("m1", "worker-1", "p1", networks=[("n1", ["10.0.0.1"]), ("internet", ["212.34.89.1"])]),
+               machine_response("m2", "worker-2", "p1", networks=[("n1", ["10.0.0.2"])]),
+           ]])
+    @patch("metal_python.api.project_api.ProjectApi.find_projects",
+           side_effect=[[
+               models.V1ProjectResponse(meta=models.V1Meta(id="p1"), name="project-1"),
+               models.V1ProjectResponse(meta=models.V1Meta(id="p2"), name="project-2"),
+           ]])
+    @patch("metal_python.api.network_api.NetworkApi.find_networks",
+           side_effect=[[
+               network("n1", "private", ["10.0.0.0/22"]),
+               network("internet", "internet", ["212.34.89.0/24"]),
+           ]])
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps",
+           side_effect=[[
+               models.V1IPResponse(ipaddress="212.34.89.1", name="ingress", networkid="internet", projectid="p1",
+                                   allocationuuid="a1", tags=[], type="static"),
+           ]])
+    def test_search_with_join(self, ips_mock, networks_mock, projects_mock, machines_mock):
+        result = self.lookup.run(["search", "machine"], variables=VARIABLES, allocation_project="p1",
+                                 join=["project", "networks", "ips"],
+                                 fields=["id", "project.name", "networks.prefixes", "ips.name"])
+
+        machines_mock.assert_called_once_with(models.V1MachineFindRequest(allocation_project="p1"))
+        projects_mock.assert_called_once_with(models.V1ProjectFindRequest())
+        networks_mock.assert_called_once_with(models.V1NetworkFindRequest())
+        ips_mock.assert_called_once_with(models.V1IPFindRequest(projectid="p1"))
+
+        self.assertEqual(result[0], [
+            dict(id="m1", project=dict(name="project-1"),
+                 networks=[dict(prefixes=["10.0.0.0/22"]), dict(prefixes=["212.34.89.0/24"])],
+                 ips=[dict(name="ingress")]),
+            dict(id="m2", project=dict(name="project-1"), networks=[dict(prefixes=["10.0.0.0/22"])], ips=[]),
+        ])
+
+    def test_unknown_join(self):
+        with self.assertRaisesRegex(AnsibleError, "image cannot be joined with project"):
+            self.lookup.run(["search", "image"], variables=VARIABLES, join="project")
+
+    def test_multiple_endpoints(self):
+        endpoints = [
+            dict(name="fra", api_url="http://fra", api_hmac="hmac"),
+            dict(name="muc", api_url="http://muc", api_token="token"),
+            dict(api_url="http://ber", api_hmac="hmac"),
+        ]
+
+        def search(requester, raw=False, **kwargs):
+            host = requester.api.api_client.configuration.host
+            if host == "http://ber":
+                raise rest.ApiException(status=503, reason="Service Unavailable")
+            return [machine_response(host[len("http://"):] + "-m1", "worker-1", "p1")]
+
+        with patch("lookup_plugins.metal.MachineRequester.search", autospec=True, side_effect=search):
+            with self.assertRaisesRegex(AnsibleError, "lookup failed for endpoints: http://ber: \\(503\\)"):
+                self.lookup.run(["search", "machine"], variables=VARIABLES, endpoints=endpoints)
+
+            with patch("lookup_plugins.metal.display.warning") as warning:
+                result = self.lookup.run(["search", "machine"], variables=VARIABLES, endpoints=endpoints,
+                                         endpoint_errors="warn", fields=["id"])
+
+        warning.assert_called_once()
+        self.assertIn("http://ber", warning.call_args.args[0])
+        self.assertEqual(result[0], [
+            dict(id="fra-m1", endpoint="fra"),
+            dict(id="muc-m1", endpoint="muc"),
+        ])
+
+    def test_explicit_api_url_overrides_endpoints_variable(self):
+        variables = dict(VARIABLES, metal_api_endpoints=[dict(name="fra", api_url="http://fra", api_hmac="hmac")])
+
+        def search(requester, raw=False, **kwargs):
+            host = requester.api.api_client.configuration.host
+            return [machine_response(host[len("http://"):] + "-m1", "worker-1", "p1")]
+
+        with patch("lookup_plugins.metal.MachineRequester.search", autospec=True, side_effect=search):
+            result = self.lookup.run(["search", "machine"], variables=variables, fields=["id"], cache=False)
+            self.assertEqual(result[0], [dict(id="fra-m1", endpoint="fra")])
+
+            result = self.lookup.run(["search", "machine"], variables=variables, api_url="http://muc",
+                                     fields=["id"], cache=False)
+            self.assertEqual(result[0], [dict(id="muc-m1")])
+
+            result = self.lookup.run(["search", "machine"], variables=variables, endpoints=None, fields=["id"],
+                                     cache=False)
+            self.assertEqual(result[0], [dict(id="somewhere-m1")])
+
+    def test_exists_with_negative_caching(self):
+        def find_machine(id):
+            if id == "missing":
+                raise rest.ApiException(status=404, reason="Not Found")
+            return machine_response(id, "worker-1", "p1")
+
+        with patch("metal_python.api.machine_api.MachineApi.find_machine", side_effect=find_machine) as mock:
+            for _ in range(3):
+                self.assertEqual(self.lookup.run(["exists", "machine"], variables=VARIABLES, id="missing"), [False])
+            self.assertEqual(self.lookup.run(["exists", "machine"], variables=VARIABLES, id="m1"), [True])
+            self.assertEqual(self.lookup.run(["exists", "machine"], variables=VARIABLES, id=["m1", "missing"]),
+                             [[True, False]])
+
+            with self.assertRaisesRegex(rest.ApiException, "machine missing does not exist"):
+                self.lookup.run(["get", "machine"], variables=VARIABLES, id="missing")
+            self.assertEqual(self.lookup.run(["get", "machine"], variables=VARIABLES, id="m1")[0]["id"], "m1")
+
+        # existing machines are not memoized by default
+        self.assertEqual(mock.call_count, 4)
+
+    def test_negative_caching_disabled(self):
+        with patch("metal_python.api.machine_api.MachineApi.find_machine",
+                   side_effect=rest.ApiException(status=404, reason="Not Found")) as mock:
+            for _ in range(2):
+                self.assertEqual(self.lookup.run(["exists", "machine"], variables=VARIABLES, id="missing",
+                                                 negative_cache_ttl=0), [False])
+
+        self.assertEqual(mock.call_count, 2)
+
+    @patch("metal_python.api.image_api.ImageApi.list_images",
+           side_effect=[[
+               image("ubuntu-22.04.20240101"),
+               image("ubuntu-24.04.20240101"),
+               image("ubuntu-24.04.20240901"),
+               image("ubuntu-24.04.20241001", features=["firewall"]),
+               image("ubuntu-24.10.20241001", expiration_date=datetime.now() - timedelta(days=1)),
+               image("debian-12.0.20240101"),
+               image("firewall-ubuntu-3.0.20240101", features=["firewall"]),
+           ]])
+    def test_latest_image(self, mock):
+        def latest(**kwargs):
+            result = self.lookup.run(["latest", "image"], variables=VARIABLES, **kwargs)[0]
+            return result["id"] if result else None
+
+        self.assertEqual(latest(os="ubuntu"), "ubuntu-24.04.20241001")
+        self.assertEqual(latest(os="ubuntu", feature="machine"), "ubuntu-24.04.20240901")
+        self.assertEqual(latest(os="ubuntu", version="22.04", feature="machine"), "ubuntu-22.04.20240101")
+        self.assertEqual(latest(os="ubuntu", version="24", feature="machine"), "ubuntu-24.04.20240901")
+        self.assertEqual(latest(os="firewall-ubuntu", version="3.0"), "firewall-ubuntu-3.0.20240101")
+        self.assertIsNone(latest(os="ubuntu", version="24.10", on_missing="none"))
+
+        with self.assertRaisesRegex(AnsibleError, "no usable image found"):
+            latest(os="centos")
+
+        mock.assert_called_once()
+
+    def test_image_index_version_ordering(self):
+        index = metal.ImageIndex([
+            dict(id="ubuntu-24.04.9", features=["machine"]),
+            dict(id="ubuntu-24.04.10", features=["machine"]),
+            dict(id="ubuntu-24.4.2", features=["machine"]),
+            dict(id="no-version", features=["machine"]),
+        ])
+
+        self.assertEqual(index.latest("ubuntu", version="24.04")["id"], "ubuntu-24.04.10")
+        self.assertIsNone(index.latest("no"))
+
+    def test_drivers_are_reused(self):
+        with patch("metal_python.api.image_api.ImageApi.find_image", return_value=image("ubuntu-24.04")):
+            self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04", cache=False)
+            self.lookup.run(["get", "image"], variables=VARIABLES, id="ubuntu-24.04", cache=False)
+        with patch("metal_python.api.size_api.SizeApi.list_sizes", return_value=[]):
+            self.lookup.run(["search", "size"], variables=VARIABLES, cache=False)
+
+        self.assertEqual(len(metal._drivers), 1)
+        self.assertEqual(len(metal._requesters), 2)
+
+        d = list(metal._drivers.values())[0]
+        self.assertIs(metal._requesters[(list(metal._drivers)[0], "image")].api.api_client, d.client)
+
+    def test_connection_pool_size(self):
+        with patch("metal_python.api.size_api.SizeApi.list_sizes", return_value=[]):
+            self.lookup.run(["search", "size"], variables=VARIABLES, connection_pool_size=2)
+
+        d = list(metal._drivers.values())[0]
+        self.assertEqual(d.client.rest_client.pool_manager.connection_pool_kw["maxsize"], 2)
+
+    def test_lru_cache_evicts_least_recently_used(self):
+        cache = metal.LRUCache(maxsize=2)
+        cache.put("a", 1, 60)
+        cache.put("b", 2, 60)
+        cache.get("a")
+        cache.put("c", 3, 60)
+
+        self.assertEqual(cache.get("a"), (True, 1))
+        self.assertEqual(cache.get("b"), (False, None))
+        self.assertEqual(cache.get("c"), (True, 3))
+
+    def test_lru_cache_expires_entries(self):
+        cache = metal.LRUCache()
+        cache.put("a", 1, -1)
+
+        self.assertEqual(cache.get("a"), (False, None))
+
+
+class TestMetalLookupBenchmark(unittest.TestCase):
+    def test_benchmark_runs_for_every_entity(self):
+        from test import metal_lookup_benchmark
+
+        results = metal_lookup_benchmark.run(sizes=[2], iterations=1)
+
+        for entity in metal.LookupModule._entities:
+            for scenario in ["deserialize", "to_dict", "lookup", "lookup_raw", "lookup_cached"]:
+                self.assertIn("%s/%s/2" % (entity, scenario), results)
+        self.assertIn("driver", results)
+
+    def test_regressions(self):
+        from test import metal_lookup_benchmark
+
+        baseline = {"a": dict(mean_ms=1.0), "b": dict(mean_ms=1.0)}
+        results = {"a": dict(mean_ms=1.1), "b": dict(mean_ms=2.0), "c": dict(mean_ms=5.0)}
+
+        self.assertEqual(metal_lookup_benchmark.regressions(results, baseline, 1.25), [("b", 1.0, 2.0)])
+
+
+class TestMetalLookupDiskCache(unittest.TestCase):
+    def setUp(self):
+        metal._memo.clear()
+        metal._drivers.clear()
+        metal._requesters.clear()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.lookup = metal.LookupModule()
+
+    @patch("metal_python.api.partition_api.PartitionApi.list_partitions",
+           side_effect=[
+               [models.V1PartitionResponse(id="fra-equ01", bootconfig=models.V1PartitionBootConfiguration())],
+           ])
+    def test_search_is_shared_between_workers(self, mock):
+        first = self.lookup.run(["search", "partition"], variables=VARIABLES, cache_dir=self.cache_dir)
+        # a forked worker starts without the memoized results of other workers
+        metal._memo.clear()
+        metal._drivers.clear()
+        metal._requesters.clear()
+        second = self.lookup.run(["search", "partition"], variables=VARIABLES, cache_dir=self.cache_dir)
+
+        mock.assert_called_once()
+        self.assertEqual(first, second)
+        self.assertEqual(second[0][0]["id"], "fra-equ01")
+
+    def test_uncached_entities_do_not_wait_for_each_other(self):
+        def find_machine(id):
+            time.sleep(0.3)
+            if id == "missing":
+                raise rest.ApiException(status=404, reason="Not Found")
+            return machine_response(id, "worker-1", "p1")
+
+        def lookup():
+            self.lookup.run(["get", "machine"], variables=VARIABLES, id="m1", cache_dir=self.cache_dir)
+
+        with patch("metal_python.api.machine_api.MachineApi.find_machine", side_effect=find_machine) as mock:
+            threads = [threading.Thread(target=lookup) for _ in range(4)]
+            start = time.monotonic()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.monotonic() - start
+
+            self.assertEqual(mock.call_count, 4)
+            self.assertLess(elapsed, 1.0)
+            self.assertEqual(os.listdir(self.cache_dir), [])
+
+            for _ in range(2):
+                metal._memo.clear()
+                self.assertEqual(self.lookup.run(["exists", "machine"], variables=VARIABLES, id="missing",
+                                                 cache_dir=self.cache_dir), [False])
+            self.assertEqual(mock.call_count, 5)
+
+    def test_datetimes_survive_the_disk_cache(self):
+        cache = metal.DiskCache(self.cache_dir)
+        now = metal.datetime.now()
+        cache.put(("k",), dict(created=now), 60)
+
+        self.assertEqual(cache.get(("k",)), (True, dict(created=now)))
+
+    def test_expired_entries_are_fetched_again(self):
+        cache = metal.DiskCache(self.cache_dir)
+        cache.put(("k",), 1, -1)
+
+        self.assertEqual(cache.get_or_fetch(("k",), 60, lambda: 2), 2)
+        self.assertEqual(cache.get(("k",)), (True, 2))
+
+    def test_single_flight(self):
+        calls = list()
+
+        def fetch():
+            calls.append(1)
+            time.sleep(0.2)
+            return "value"
+
+        results = list()
+
+        def worker():
+            results.append(metal.DiskCache(self.cache_dir).get_or_fetch(("k",), 60, fetch))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ["value"] * 5)
+
+    def test_size_based_eviction(self):
+        cache = metal.DiskCache(self.cache_dir, max_bytes=200)
+        for i in range(10):
+            cache.put(("k", i), "x" * 50, 60)
+
+        files = [f for f in os.listdir(self.cache_dir) if f.endswith(".json")]
+        self.assertLessEqual(len(files), 3)
+        self.assertEqual(cache.get(("k", 9)), (True, "x" * 50))
+        self.assertEqual(cache.get(("k", 0)), (False, None))
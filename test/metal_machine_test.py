@@ -5,13 +5,19 @@ from test import (
     AnsibleFailJson,
     AnsibleExitJson,
     set_module_args,
+    machine_response,
+    provisioning_events,
     MODULES_PATH,
 )
-from metal_python import models
+from metal_python import models, rest
 
 sys.path.insert(0, MODULES_PATH)
 
 
+def free_machine_response(id, rack):
+    return machine_response(id, allocated=False, tags=(), rack=rack)
+
+
 class TestMetalMachineModule(MetalModules):
     def setUp(self):
         self.defaultSetUpTasks()
@@ -38,6 +44,37 @@ class TestMetalMachineModule(MetalModules):
                                     "{'msg': 'either id or name must be given', 'failed': True}"):
             self.module.main()
 
+    @patch("metal_python.api.machine_api.MachineApi.find_machines")
+    @patch("metal_python.api.machine_api.MachineApi.allocate_machine")
+    def test_machine_bulk_count_zero(self, allocate_mock, find_mock):
+        for params in [dict(name="worker", count=0), dict(machines=[])]:
+            set_module_args(dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="a-project",
+                **params
+            ))
+
+            with self.assertRaises(AnsibleExitJson) as result:
+                self.module.main()
+
+            self.assertDictEqual(result.exception.module_results, dict(changed=False, machines=[]))
+
+        find_mock.assert_not_called()
+        allocate_mock.assert_not_called()
+
+    def test_module_fail_when_waiting_for_many_machines(self):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            project="a-project",
+            name="worker",
+            count=2,
+            wait=True,
+        ))
+        with self.assertRaisesRegex(AnsibleFailJson, "use the metal_machine_wait module"):
+            self.module.main()
+
     @patch("metal_python.api.machine_api.MachineApi.find_machines",
            side_effect=[
                [
@@ -420,3 +457,383 @@ class TestMetalMachineModule(MetalModules):
             changed=True,
         )
         self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("2", "worker-2")]])
+    @patch("metal_python.api.machine_api.MachineApi.allocate_machine",
+           side_effect=lambda r: machine_response("id-" + r.name, r.name))
+    def test_machine_bulk_count(self, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="worker",
+                count=3,
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+                networks=["internet"],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1MachineFindRequest(
+            allocation_project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+        self.assertEqual(allocate_mock.call_count, 2)
+        allocate_mock.assert_any_call(models.V1MachineAllocateRequest(
+            name="worker-3",
+            hostname="worker-3",
+            projectid="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+            imageid="ubuntu",
+            partitionid="partition-id",
+            sizeid="c1",
+            networks=[models.V1MachineAllocationNetwork(autoacquire=True, networkid="internet")],
+            ips=[],
+            ssh_pub_keys=[],
+            tags=["ci.metal-stack.io/manager=ansible"],
+        ))
+
+        expected = dict(
+            changed=True,
+            machines=[
+                dict(name="worker-1", state="present", id="id-worker-1", changed=True),
+                dict(name="worker-2", state="present", id="2", changed=False),
+                dict(name="worker-3", state="present", id="id-worker-3", changed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("1", "a"), machine_response("2", "b", tags=[])]])
+    @patch("metal_python.api.machine_api.MachineApi.free_machine",
+           side_effect=lambda id: machine_response(id, "a"))
+    def test_machine_bulk_absent_partial_failure(self, free_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                machines=[dict(name="a"), dict(name="b"), dict(name="c")],
+                state="absent",
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        free_mock.assert_called_once_with("1")
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "not all machines could be managed")
+        self.assertTrue(results["changed"])
+        self.assertEqual(results["machines"][0], dict(name="a", state="absent", id="1", changed=True))
+        self.assertTrue(results["machines"][1]["failed"])
+        self.assertEqual(results["machines"][2], dict(name="c", state="absent", id=None, changed=False))
+
+    def test_machine_bulk_duplicate_names(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                machines=[dict(name="a"), dict(name="a")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "machine names must be unique"):
+            self.module.main()
+
+    @patch("time.sleep")
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("1", "test", succeeded=False)]])
+    @patch("metal_python.api.machine_api.MachineApi.find_machine",
+           side_effect=[
+               machine_response("1", "test", succeeded=False, events=provisioning_events("PXE Booting")),
+               machine_response("1", "test", events=provisioning_events("PXE Booting", "Phoned Home")),
+           ])
+    def test_machine_wait(self, find_mock, find_machines_mock, sleep_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                wait=True,
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        self.assertEqual(find_mock.call_count, 2)
+        find_mock.assert_called_with("1")
+        sleep_mock.assert_called_once()
+
+        expected = dict(
+            id="1",
+            changed=False,
+            events=[
+                dict(time="2024-01-01T00:00:00+00:00", event="PXE Booting", message=""),
+                dict(time="2024-01-01T00:00:01+00:00", event="Phoned Home", message=""),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("time.sleep")
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("1", "test", succeeded=False)]])
+    @patch("metal_python.api.machine_api.MachineApi.find_machine",
+           side_effect=[
+               machine_response("1", "test", succeeded=False,
+                                events=provisioning_events("PXE Booting", "Crashed", crash_loop=True)),
+           ])
+    def test_machine_wait_crash_loop(self, find_mock, find_machines_mock, sleep_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                wait=True,
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        sleep_mock.assert_not_called()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "machine provisioning failed: machine is in a provisioning crash loop")
+        self.assertEqual([e["event"] for e in results["events"]], ["PXE Booting", "Crashed"])
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("1", "test", description="old",
+                                          tags=["ci.metal-stack.io/manager=ansible", "a",
+                                                "machine.metal-stack.io/network.primary.asn=4200000001"])]])
+    @patch("metal_python.api.machine_api.MachineApi.update_machine",
+           side_effect=[machine_response("1", "test")])
+    def test_machine_present_update(self, update_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                description="new",
+                tags=["b"],
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        update_mock.assert_called_once_with(models.V1MachineUpdateRequest(
+            id="1",
+            description="new",
+            ssh_pub_keys=[],
+            tags=["b", "machine.metal-stack.io/network.primary.asn=4200000001", "ci.metal-stack.io/manager=ansible"],
+        ))
+
+        self.assertDictEqual(result.exception.module_results, dict(id="1", changed=True))
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[
+               machine_response("1", "a", description="same", tags=["ci.metal-stack.io/manager=ansible", "x"]),
+               machine_response("2", "b", tags=["ci.metal-stack.io/manager=ansible"]),
+           ]])
+    @patch("metal_python.api.machine_api.MachineApi.update_machine",
+           side_effect=lambda r: machine_response(r.id, "b"))
+    def test_machine_bulk_update(self, update_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                machines=[
+                    dict(name="a", description="same", tags=["x"]),
+                    dict(name="b", tags=["y"]),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        update_mock.assert_called_once_with(models.V1MachineUpdateRequest(
+            id="2",
+            description="",
+            ssh_pub_keys=[],
+            tags=["y", "ci.metal-stack.io/manager=ansible"],
+        ))
+
+        self.assertEqual([m["changed"] for m in result.exception.module_results["machines"]], [False, True])
+
+    def test_placement_plan(self):
+        machines = [free_machine_response("a%d" % i, "rack-a") for i in range(3)] + \
+                   [free_machine_response("b%d" % i, "rack-b") for i in range(2)] + \
+                   [free_machine_response("c0", "rack-c")]
+
+        spread = self.module.Placement(machines, "spread")
+        self.assertEqual(spread.plan(4), ["rack-a", "rack-b", "rack-c", "rack-a"])
+
+        pack = self.module.Placement(machines, "pack")
+        self.assertEqual(pack.plan(4), ["rack-a", "rack-a", "rack-a", "rack-b"])
+
+        self.assertEqual(pack.take("rack-c"), ("rack-c", "c0"))
+        self.assertEqual(pack.take("rack-c"), ("rack-a", "a0"))
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[
+               [],
+               [free_machine_response("a0", "rack-a"), free_machine_response("a1", "rack-a"),
+                free_machine_response("b0", "rack-b"), machine_response("b1", "other")],
+           ])
+    @patch("metal_python.api.machine_api.MachineApi.allocate_machine")
+    def test_machine_bulk_spread(self, allocate_mock, find_mock):
+        def allocate(r):
+            if r.uuid == "a0":
+                raise rest.ApiException(status=409, reason="machine already allocated")
+            return machine_response(r.uuid, r.name)
+        allocate_mock.side_effect = allocate
+
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="worker",
+                count=2,
+                placement="spread",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+                networks=["internet"],
+                parallelism=1,
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_with(models.V1MachineFindRequest(partition_id="partition-id", sizeid="c1"))
+        self.assertEqual(allocate_mock.call_count, 3)
+
+        expected = dict(
+            changed=True,
+            machines=[
+                dict(name="worker-1", state="present", id="a1", rack="rack-a", changed=True),
+                dict(name="worker-2", state="present", id="b0", rack="rack-b", changed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[
+               [],
+               [free_machine_response("a0", "rack-a"), free_machine_response("b0", "rack-b")],
+           ])
+    @patch("metal_python.api.machine_api.MachineApi.allocate_machine",
+           side_effect=rest.ApiException(status=422, reason="image not found"))
+    def test_machine_bulk_placement_no_retry(self, allocate_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="worker",
+                count=1,
+                placement="spread",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+                networks=["internet"],
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        allocate_mock.assert_called_once()
+        self.assertIn("image not found", result.exception.module_results["machines"][0]["msg"])
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[], [free_machine_response("a0", "rack-a")]])
+    def test_machine_bulk_placement_not_enough_machines(self, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="worker",
+                count=2,
+                placement="pack",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "not enough free machines for placement")
+        self.assertEqual((results["free"], results["required"]), (1, 2))
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("1", "test", description="old",
+                                          tags=["ci.metal-stack.io/manager=ansible", "team=a"])]])
+    @patch("metal_python.api.machine_api.MachineApi.update_machine",
+           side_effect=[machine_response("1", "test")])
+    def test_machine_present_update_keeps_tags(self, update_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="test",
+                description="new",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        update_mock.assert_called_once_with(models.V1MachineUpdateRequest(
+            id="1",
+            description="new",
+            ssh_pub_keys=[],
+            tags=["ci.metal-stack.io/manager=ansible", "team=a"],
+        ))
+        self.assertDictEqual(result.exception.module_results, dict(id="1", changed=True))
+
+    @patch("metal_python.api.machine_api.MachineApi.find_machine",
+           side_effect=[free_machine_response("1", "rack-a")])
+    @patch("metal_python.api.machine_api.MachineApi.update_machine")
+    @patch("metal_python.api.machine_api.MachineApi.allocate_machine",
+           side_effect=[machine_response("1", "test")])
+    def test_machine_present_by_id_not_allocated(self, allocate_mock, update_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                id="1",
+                name="test",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                size="c1",
+                image="ubuntu",
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        update_mock.assert_not_called()
+        self.assertEqual(allocate_mock.call_args[0][0].uuid, "1")
+        self.assertDictEqual(result.exception.module_results, dict(id="1", changed=True))
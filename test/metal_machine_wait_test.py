@@ -0,0 +1,115 @@
+import itertools
+import sys
+from mock import patch
+from test import (
+    MetalModules,
+    AnsibleFailJson,
+    AnsibleExitJson,
+    set_module_args,
+    machine_response,
+    provisioning_events,
+    MODULES_PATH,
+)
+from metal_python import models
+
+sys.path.insert(0, MODULES_PATH)
+
+
+def machine(id, name, succeeded=True, crash_loop=False, event="Phoned Home"):
+    return machine_response(id, name, tags=(), succeeded=succeeded,
+                            events=provisioning_events(event, crash_loop=crash_loop))
+
+
+class TestMetalMachineWaitModule(MetalModules):
+    def setUp(self):
+        self.defaultSetUpTasks()
+
+        import metal_machine_wait
+        self.module = metal_machine_wait
+
+    def test_module_fail_when_no_project(self):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            ids=["1", "2"],
+        ))
+        with self.assertRaisesRegex(AnsibleFailJson, "missing required arguments: project"):
+            self.module.main()
+
+    @patch("time.sleep")
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[
+               [machine("1", "a", succeeded=False, event="PXE Booting"), machine("2", "b")],
+               [machine("1", "a"), machine("2", "b"), machine("3", "c", succeeded=False)],
+           ])
+    def test_wait_for_ids(self, find_mock, sleep_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            ids=["1", "2"],
+            project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        self.assertEqual(find_mock.call_count, 2)
+        find_mock.assert_called_with(models.V1MachineFindRequest(
+            allocation_project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+        sleep_mock.assert_called_once()
+
+        results = result.exception.module_results
+        self.assertEqual(results["polls"], 2)
+        self.assertFalse(results["changed"])
+        self.assertEqual([m["id"] for m in results["machines"]], ["1", "2"])
+        self.assertEqual([(t["state"], t["event"]) for t in results["machines"][0]["transitions"]],
+                         [("pending", "PXE Booting"), ("ready", "Phoned Home")])
+        self.assertEqual([t["state"] for t in results["machines"][1]["transitions"]], ["ready"])
+
+    @patch("time.sleep")
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[
+               [machine("1", "a", succeeded=False), machine("2", "b", succeeded=False, crash_loop=True)],
+           ])
+    def test_wait_fails_on_crash_loop(self, find_mock, sleep_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        sleep_mock.assert_not_called()
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "machine provisioning failed")
+        self.assertEqual(results["ids"], ["2"])
+        self.assertEqual(results["machines"][1]["reason"], "machine is in a provisioning crash loop")
+
+    @patch("time.monotonic", side_effect=itertools.count(0, 4))
+    @patch("time.sleep")
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine("1", "a", succeeded=False)]] * 2)
+    def test_wait_timeout(self, find_mock, sleep_mock, monotonic_mock):
+        set_module_args(dict(
+            api_url="http://somewhere",
+            api_hmac="hmac",
+            ids=["1", "2"],
+            project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+            timeout=15,
+        ))
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_with(models.V1MachineFindRequest(
+            allocation_project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+
+        results = result.exception.module_results
+        self.assertEqual(results["msg"], "timeout waiting for machines to become ready")
+        self.assertEqual(results["polls"], 2)
+        self.assertEqual({m["id"]: m["state"] for m in results["machines"]}, {"1": "pending", "2": "missing"})
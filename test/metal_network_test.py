@@ -12,6 +12,30 @@ from metal_python import models
 sys.path.insert(0, MODULES_PATH)
 
 
+def network_response(id, name, prefixes, description=None, labels=None, partition="fra-equ01",
+                     project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f"):
+    return models.V1NetworkResponse(id=id,
+                                    name=name,
+                                    description=description,
+                                    prefixes=prefixes,
+                                    partitionid=partition,
+                                    projectid=project,
+                                    destinationprefixes=[],
+                                    nat=False,
+                                    parentnetworkid="parent",
+                                    privatesuper=False,
+                                    underlay=False,
+                                    shared=False,
+                                    labels={"ci.metal-stack.io/manager": "ansible"} if labels is None else labels,
+                                    consumption=models.V1NetworkConsumption(),
+                                    usage=models.V1NetworkUsage(
+                                        available_ips=10,
+                                        available_prefixes=1,
+                                        used_ips=1,
+                                        used_prefixes=1,
+                                    ))
+
+
 class TestMetalNetworkModule(MetalModules):
     def setUp(self):
         self.defaultSetUpTasks()
@@ -294,3 +318,91 @@ class TestMetalNetworkModule(MetalModules):
             changed=True,
         )
         self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.network_api.NetworkApi.find_networks")
+    @patch("metal_python.api.network_api.NetworkApi.allocate_network",
+           side_effect=lambda r: network_response("id-" + r.name, r.name, ["10.0.4.0/22"], r.description))
+    @patch("metal_python.api.network_api.NetworkApi.update_network",
+           side_effect=lambda r: network_response(r.id, "backup", ["10.0.8.0/22"], r.description))
+    @patch("metal_python.api.network_api.NetworkApi.free_network",
+           side_effect=lambda id: network_response(id, "legacy", ["10.0.12.0/22"]))
+    def test_network_bulk(self, free_mock, update_mock, allocate_mock, find_mock):
+        def find(r):
+            if r.partitionid == "fra-equ01":
+                return [
+                    network_response("backup-id", "backup", ["10.0.8.0/22"], "old"),
+                    network_response("legacy-id", "legacy", ["10.0.12.0/22"]),
+                ]
+            return [network_response("other-id", "storage", ["10.1.0.0/22"], partition="fra-equ02")]
+        find_mock.side_effect = find
+
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="fra-equ01",
+                networks=[
+                    dict(name="storage"),
+                    dict(name="storage", partition="fra-equ02"),
+                    dict(name="backup", description="new"),
+                    dict(name="legacy", state="absent"),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        self.assertEqual(find_mock.call_count, 2)
+        find_mock.assert_any_call(models.V1NetworkFindRequest(
+            partitionid="fra-equ01",
+            projectid="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+        allocate_mock.assert_called_once_with(models.V1NetworkAllocateRequest(
+            name="storage",
+            labels={"ci.metal-stack.io/manager": "ansible"},
+            shared=False,
+            partitionid="fra-equ01",
+            projectid="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+        ))
+        update_mock.assert_called_once_with(models.V1NetworkUpdateRequest(id="backup-id", description="new"))
+        free_mock.assert_called_once_with("legacy-id")
+
+        results = result.exception.module_results
+        self.assertTrue(results["changed"])
+        self.assertEqual([(n["name"], n["partition"], n["id"], n["prefixes"], n["changed"])
+                          for n in results["networks"]], [
+            ("storage", "fra-equ01", "id-storage", ["10.0.4.0/22"], True),
+            ("storage", "fra-equ02", "other-id", ["10.1.0.0/22"], False),
+            ("backup", "fra-equ01", "backup-id", ["10.0.8.0/22"], True),
+            ("legacy", "fra-equ01", "legacy-id", ["10.0.12.0/22"], True),
+        ])
+
+    def test_network_bulk_partition_required(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                networks=[dict(name="storage")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "partition and project must be given for network"):
+            self.module.main()
+
+    def test_network_bulk_exclusive_with_single_network(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                project="12e1b1db-44d7-4f57-9c9d-5799b582ab8f",
+                partition="partition-id",
+                name="storage",
+                networks=[dict(name="storage")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "parameters are mutually exclusive: networks\\|name"):
+            self.module.main()
@@ -5,6 +5,7 @@ from test import (
     AnsibleFailJson,
     AnsibleExitJson,
     set_module_args,
+    machine_response,
     MODULES_PATH,
 )
 from metal_python import models
@@ -12,6 +13,47 @@ from metal_python import models
 sys.path.insert(0, MODULES_PATH)
 
 
+def project_response(id, name, tenant="tt", description="desc", labels=None, managed=True):
+    return models.V1ProjectResponse(
+        description=description,
+        meta=models.V1Meta(
+            id=id,
+            annotations={"ci.metal-stack.io/manager": "ansible"} if managed else {},
+            labels=labels,
+        ),
+        name=name,
+        tenant_id=tenant,
+    )
+
+
+def ip_response(address, tags=("ci.metal-stack.io/manager=ansible",), type="static"):
+    return models.V1IPResponse(
+        type=type,
+        ipaddress=address,
+        allocationuuid="a-unique-id",
+        networkid="internet",
+        projectid="1",
+        tags=list(tags),
+    )
+
+
+def network_response(id, labels=None):
+    return models.V1NetworkResponse(
+        id=id,
+        prefixes=["10.0.0.0/22"],
+        projectid="1",
+        destinationprefixes=[],
+        nat=False,
+        parentnetworkid="parent",
+        privatesuper=False,
+        underlay=False,
+        shared=False,
+        labels={"ci.metal-stack.io/manager": "ansible"} if labels is None else labels,
+        consumption=models.V1NetworkConsumption(),
+        usage=models.V1NetworkUsage(available_ips=10, available_prefixes=1, used_ips=1, used_prefixes=1),
+    )
+
+
 class TestMetalProjectModule(MetalModules):
     def setUp(self):
         self.defaultSetUpTasks()
@@ -271,3 +313,193 @@ class TestMetalProjectModule(MetalModules):
             changed=True,
         )
         self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.project_api.ProjectApi.find_projects",
+           side_effect=[[
+               project_response("1", "a"),
+               project_response("2", "b", description="old"),
+               project_response("3", "c"),
+               project_response("4", "unmanaged", managed=False),
+               project_response("5", "obsolete"),
+           ]])
+    @patch("metal_python.api.project_api.ProjectApi.create_project",
+           side_effect=lambda r: project_response("id-" + r.name, r.name))
+    @patch("metal_python.api.project_api.ProjectApi.update_project",
+           side_effect=lambda r: project_response(r.meta.id, "b"))
+    @patch("metal_python.api.project_api.ProjectApi.delete_project",
+           side_effect=lambda id: project_response(id, "deleted"))
+    def test_project_catalog(self, delete_mock, update_mock, create_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                tenant="tt",
+                prune=True,
+                projects=[
+                    dict(name="a", description="desc"),
+                    dict(name="b", description="new"),
+                    dict(name="c", state="absent"),
+                    dict(name="d", description="desc"),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1ProjectFindRequest())
+        create_mock.assert_called_once_with(models.V1ProjectCreateRequest(
+            description="desc",
+            name="d",
+            tenant_id="tt",
+            meta=models.V1Meta(annotations={"ci.metal-stack.io/manager": "ansible"}),
+        ))
+        update_mock.assert_called_once_with(models.V1ProjectUpdateRequest(
+            description="new",
+            meta=models.V1Meta(id="2"),
+        ))
+        self.assertEqual(sorted(c[0][0] for c in delete_mock.call_args_list), ["3", "5"])
+
+        expected = dict(
+            changed=True,
+            projects=[
+                dict(name="a", state="present", id="1", changed=False),
+                dict(name="b", state="present", id="2", changed=True),
+                dict(name="c", state="absent", id="3", changed=True),
+                dict(name="d", state="present", id="id-d", changed=True),
+                dict(name="obsolete", state="absent", id="5", changed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.project_api.ProjectApi.find_projects",
+           side_effect=[[
+               project_response("1", "a"),
+               project_response("2", "b", tenant="other"),
+               project_response("3", "c"),
+               project_response("4", "foreign", tenant="other"),
+           ]])
+    @patch("metal_python.api.project_api.ProjectApi.create_project")
+    @patch("metal_python.api.project_api.ProjectApi.update_project",
+           side_effect=lambda r: project_response(r.meta.id, "c", tenant="other"))
+    @patch("metal_python.api.project_api.ProjectApi.delete_project")
+    def test_project_catalog_item_tenant(self, delete_mock, update_mock, create_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                tenant="tt",
+                prune=True,
+                projects=[
+                    dict(name="a", description="desc"),
+                    dict(name="b", description="desc", tenant="other"),
+                    dict(name="c", description="desc", tenant="other"),
+                ],
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_mock.assert_called_once_with(models.V1ProjectFindRequest())
+        create_mock.assert_not_called()
+        delete_mock.assert_not_called()
+        update_mock.assert_called_once_with(models.V1ProjectUpdateRequest(
+            meta=models.V1Meta(id="3"),
+            tenant_id="other",
+        ))
+
+        expected = dict(
+            changed=True,
+            projects=[
+                dict(name="a", state="present", id="1", changed=False),
+                dict(name="b", state="present", id="2", changed=False),
+                dict(name="c", state="present", id="3", changed=True),
+            ],
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    def test_project_catalog_prune_requires_tenant(self):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                prune=True,
+                projects=[dict(name="a")],
+            )
+        )
+
+        with self.assertRaisesRegex(AnsibleFailJson, "tenant is required for pruning projects"):
+            self.module.main()
+
+    @patch("metal_python.api.project_api.ProjectApi.find_projects", side_effect=[[project_response("1", "a")]])
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("m1", networks=[("internet", ["212.34.83.1"])]), machine_response("m2")]])
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps",
+           side_effect=[[ip_response("212.34.83.5"), ip_response("212.34.83.1", type="ephemeral"),
+                         ip_response("212.34.83.6", type="ephemeral")]])
+    @patch("metal_python.api.network_api.NetworkApi.find_networks", side_effect=[[network_response("n1")]])
+    @patch("metal_python.api.machine_api.MachineApi.free_machine", side_effect=machine_response)
+    @patch("metal_python.api.ip_api.IpApi.free_ip", side_effect=ip_response)
+    @patch("metal_python.api.network_api.NetworkApi.free_network", side_effect=network_response)
+    @patch("metal_python.api.project_api.ProjectApi.delete_project", side_effect=[project_response("1", "a")])
+    def test_project_absent_cascade(self, delete_mock, free_network_mock, free_ip_mock, free_machine_mock,
+                                    find_networks_mock, find_ips_mock, find_machines_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="a",
+                state="absent",
+                cascade=True,
+            )
+        )
+
+        with self.assertRaises(AnsibleExitJson) as result:
+            self.module.main()
+
+        find_machines_mock.assert_called_once_with(models.V1MachineFindRequest(allocation_project="1"))
+        find_ips_mock.assert_called_once_with(models.V1IPFindRequest(projectid="1"))
+        find_networks_mock.assert_called_once_with(models.V1NetworkFindRequest(projectid="1"))
+        self.assertEqual(free_machine_mock.call_count, 2)
+        self.assertEqual(sorted(c[0][0] for c in free_ip_mock.call_args_list), ["212.34.83.5", "212.34.83.6"])
+        free_network_mock.assert_called_once_with("n1")
+        delete_mock.assert_called_once_with("1")
+
+        expected = dict(
+            id="1",
+            changed=True,
+            released=dict(machines=["m1", "m2"], ips=["212.34.83.5", "212.34.83.6"], networks=["n1"]),
+        )
+        self.assertDictEqual(result.exception.module_results, expected)
+
+    @patch("metal_python.api.project_api.ProjectApi.find_projects", side_effect=[[project_response("1", "a")]])
+    @patch("metal_python.api.machine_api.MachineApi.find_machines",
+           side_effect=[[machine_response("m1", networks=[("internet", ["212.34.83.1"])]),
+                         machine_response("m2", tags=[])]])
+    @patch("metal_python.api.ip_api.IpApi.find_i_ps",
+           side_effect=[[ip_response("212.34.83.1", tags=[], type="ephemeral"),
+                         ip_response("212.34.83.6", tags=[], type="ephemeral")]])
+    @patch("metal_python.api.network_api.NetworkApi.find_networks", side_effect=[[network_response("n1", labels={})]])
+    @patch("metal_python.api.machine_api.MachineApi.free_machine")
+    @patch("metal_python.api.project_api.ProjectApi.delete_project")
+    def test_project_absent_cascade_unmanaged(self, delete_mock, free_machine_mock, find_networks_mock, find_ips_mock,
+                                              find_machines_mock, find_mock):
+        set_module_args(
+            dict(
+                api_url="http://somewhere",
+                api_hmac="hmac",
+                name="a",
+                state="absent",
+                cascade=True,
+            )
+        )
+
+        with self.assertRaises(AnsibleFailJson) as result:
+            self.module.main()
+
+        free_machine_mock.assert_not_called()
+        delete_mock.assert_not_called()
+
+        results = result.exception.module_results
+        self.assertDictEqual(results["unmanaged"], dict(machines=["m2"], ips=["212.34.83.6"], networks=["n1"]))